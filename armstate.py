@@ -0,0 +1,52 @@
+import os
+import json
+import datetime
+from config import *
+
+# File holding the arm position left by the last clean shutdown
+state_path = '/home/pi/cvt60_state.json'
+
+"""
+Settings that change where home is. A saved position is only trusted
+if they have not changed since it was saved.
+"""
+def home_key():
+    return [step_mode, stepper_cal_1, stepper_cal_2,
+            stepper_1_deg_to_step, stepper_2_deg_to_step]
+
+"""
+Position of both steppers in steps from home saved by the last clean
+shutdown, or None if there was none or it can no longer be trusted.
+"""
+def load():
+    try:
+        with open(state_path) as file:
+            state = json.load(file)
+        if state['clean'] and state['home'] == home_key():
+            return tuple(int(steps) for steps in state['position'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+"""
+Save the position of both steppers with a clean shutdown marker.
+"""
+def save(stepper_1, stepper_2):
+    state = dict(position=[stepper_1, stepper_2], clean=True, home=home_key(),
+                 date=str(datetime.datetime.now()))
+    # Write to a temporary file first so a partial state is never loaded
+    with open(state_path + '.tmp', 'w') as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(state_path + '.tmp', state_path)
+
+"""
+Remove the saved position, so a run that does not shut down cleanly
+leaves none behind.
+"""
+def clear():
+    try:
+        os.remove(state_path)
+    except FileNotFoundError:
+        pass
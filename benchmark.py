@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import platform
+import numpy as np
+from time import perf_counter
+
+# Run everything against the simulated board
+os.environ['CVT60_SIM'] = '1'
+
+import config
+import kinematics
+import motion
+import motionprofile
+import route
+import simulate
+import waveform
+
+# Number of repeats for the fast benchmarks
+repeats = 50
+
+"""
+Step counts of both axes for every move of a planned cycle.
+"""
+def cycle_moves():
+    path = [None] + [jar for jar, feed in route.expand(route.plan())] + [None]
+    steps = [route.jar_steps(jar) for jar in path]
+    return [(a[0] - b[0], a[1] - b[1]) for a, b in zip(steps, steps[1:])
+            if a != b]
+
+"""
+Best of several runs of a function, in seconds.
+"""
+def best_time(function, count=repeats):
+    best = float('inf')
+    for i in range(count):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+"""
+Inverse kinematics throughput over the whole jar grid.
+"""
+def bench_ik():
+    x, y = np.meshgrid(np.arange(config.jar_cols), np.arange(config.jar_rows), indexing='ij')
+    x_coord, y_coord = kinematics.jar_coords(x, y)
+    grid = best_time(lambda: kinematics.inverse(x_coord, y_coord))
+    table = best_time(kinematics.build_jar_table)
+    return {
+        'jars': int(x.size),
+        'grid_ik_us': grid * 1e6,
+        'jars_per_s': x.size / grid,
+        'jar_table_build_ms': table * 1e3,
+        }
+
+"""
+Time to generate the delay tables for every move of a cycle, uncached.
+"""
+def bench_profiles(moves):
+    counts = sorted({abs(n) for move in moves for n in move})
+    results = {}
+    for shape in ('trapezoid', 'scurve'):
+        config.motion_profile = shape
+        def generate():
+            motionprofile.delay_table.cache_clear()
+            for n in counts:
+                motionprofile.delays(n, 1)
+        total = best_time(generate, 5)
+        results[shape] = {
+            'tables': len(counts),
+            'total_ms': total * 1e3,
+            'per_table_us': total / len(counts) * 1e6,
+            }
+    config.motion_profile = 'trapezoid'
+    motionprofile.delay_table.cache_clear()
+    return results
+
+def compile_move(step_count_1, step_count_2):
+    times_1, times_2, duration = motion.coordinate(motionprofile.delays(step_count_1, 1),
+                                                   motionprofile.delays(step_count_2, 2))
+    pulses = waveform.pulse_train({21: times_1, 12: times_2}, duration)
+    runs = waveform.blocks(pulses)
+    return pulses, runs
+
+"""
+Time spent turning delay tables into wave blocks, per step pulse.
+"""
+def bench_scheduling(moves):
+    def compile_all():
+        return sum(len(compile_move(*move)[0]) for move in moves)
+    pulses = compile_all()
+    total = best_time(compile_all, 5)
+    steps = sum(abs(n) for move in moves for n in move)
+    return {
+        'moves': len(moves),
+        'steps': steps,
+        'pulses': pulses,
+        'total_ms': total * 1e3,
+        'per_pulse_us': total / pulses * 1e6,
+        }
+
+"""
+Timing error of generated step pulses against their ideal times.
+The lead axis is compared with its unrounded delay table and the
+following axis with exact proportional interpolation of the lead.
+"""
+def bench_pulse_error(moves):
+    lead_errors, follow_errors = [], []
+    for step_count_1, step_count_2 in moves:
+        delays_1 = motionprofile.delays(step_count_1, 1)
+        delays_2 = motionprofile.delays(step_count_2, 2)
+        times_1, times_2, duration = motion.coordinate(delays_1, delays_2)
+
+        # Rising edge times of each step pin in the pulse train
+        pulses = waveform.pulse_train({21: times_1, 12: times_2}, duration)
+        edge_times = np.concatenate(([0], np.cumsum([p[2] for p in pulses])))[:-1]
+        on = np.array([p[0] for p in pulses])
+        actual = {pin: edge_times[(on & (1 << pin)) != 0] for pin in (21, 12)}
+
+        lead_pin, lead_delays, n, follow_pin, m = (21, delays_1, len(delays_1), 12, len(delays_2)) \
+            if len(delays_1) >= len(delays_2) else (12, delays_2, len(delays_2), 21, len(delays_1))
+        ideal = np.concatenate(([0], np.cumsum(lead_delays)))[:-1] * 1e6
+        ideal *= duration / (lead_delays.sum() * 1e6)
+        lead_errors.append(np.abs(actual[lead_pin] - ideal))
+        if m:
+            # Ideal follower step j happens at lead progress j*n/m
+            progress = np.arange(1, m+1) * n / m - 1
+            follow_ideal = np.interp(progress, np.arange(n), ideal)
+            follow_errors.append(np.abs(actual[follow_pin] - follow_ideal))
+
+    lead, follow = np.concatenate(lead_errors), np.concatenate(follow_errors)
+    return {
+        'lead_mean_us': float(lead.mean()),
+        'lead_max_us': float(lead.max()),
+        'follow_mean_us': float(follow.mean()),
+        'follow_max_us': float(follow.max()),
+        }
+
+"""
+Projected full-cycle time for each feeding day on the simulator.
+"""
+def bench_cycles():
+    results = {}
+    for day in sorted(config.load_angle):
+        start = perf_counter()
+        result, projected = simulate.simulate(day)
+        results[day] = {
+            'result': result,
+            'projected_s': projected,
+            'simulated_s': perf_counter() - start,
+            }
+    return results
+
+def run():
+    moves = cycle_moves()
+    return {
+        'python': platform.python_version(),
+        'ik': bench_ik(),
+        'profiles': bench_profiles(moves),
+        'scheduling': bench_scheduling(moves),
+        'pulse_error': bench_pulse_error(moves),
+        'cycles': bench_cycles(),
+        }
+
+
+if __name__ == '__main__':
+    # Results are printed as JSON, and also written to a file if given
+    results = json.dumps(run(), indent=2)
+    print(results)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as file:
+            file.write(results + '\n')
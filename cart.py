@@ -1,364 +1,696 @@
-#!/usr/bin/python3
-
-import math
-import datetime
-import pigpio
-import sys
-import os
-import threading
-from time import sleep
-from subprocess import call
-
-# Serial number of CVT60 unit
-unit_number = '001'
-
-# Step adjustment to bring axes parallel with wall when homed
-# (positive = toward wall, negative = away from wall)
-stepper_cal_1, stepper_cal_2 = 5, 10
-
-# Number of microsteps per full step (e.g. half step = 2)
-step_mode = 8
-
-# Time to wait between individual steps in seconds
-wait = (8 / step_mode) / 1000
-
-# Number of columns and rows of jars on cart
-jar_cols, jar_rows = 11, 7
-
-# Diameter of jars in mm
-jar_diam = 78
-
-# Location of arm shoulder axis relative to jars in mm
-ori_x = jar_cols*jar_diam / 2
-ori_y = -6
-
-# Length of arm sections in mm
-arm_1, arm_2 = 330, 330
-
-# Coefficient for converting degrees to steps
-# (pulley tooth count/motor tooth count * steps per revolution/360)
-stepper_1_deg_to_step = 116/20 * 200/360 * step_mode
-stepper_2_deg_to_step = 80/20 * 200/360 * step_mode
-
-# Number of steps over which to implement easing function
-ease_count = 20 * step_mode
-
-# Assign pigpio to Raspberry Pi
-pi = pigpio.pi()
-
-# Initialize stepper positions
-stepper_1 = stepper_2 = 0
-
-CW = 0                  # Clockwise stepper movement
-CCW = 1                 # Counterclockwise stepper movement
-enable = 1              # Enable stepper
-disable = 0             # Disable stepper
-
-# Pin assignments. All numbers are BCM, not physical pin number.
-step_pin_1   =    21    # First axis stepper movement
-dir_pin_1    =    13    # First axis stepper direction
-step_pin_2   =    12    # Second axis stepper movement
-dir_pin_2    =    20    # Second axis stepper direction
-ena_pin      =    24    # Stepper enable via relay switch
-
-servo_pin    =    27    # Servo controlling measure plate, PWM at 50Hz
-dc_pin       =    4     # DC vibration motor
-lmt_pin_1    =    23    # Limit switch for homing first axis
-lmt_pin_2    =    22    # Limit switch for homing second axis
-stop_pin     =    2     # Stop button for halting program
-
-pi.set_mode(step_pin_1, pigpio.OUTPUT)
-pi.write(step_pin_1, 0)
-pi.set_mode(dir_pin_1, pigpio.OUTPUT)
-pi.write(dir_pin_1, 0)
-pi.set_mode(step_pin_2, pigpio.OUTPUT)
-pi.write(step_pin_2, 0)
-pi.set_mode(dir_pin_2, pigpio.OUTPUT)
-pi.write(dir_pin_2, 0)
-pi.set_mode(ena_pin, pigpio.OUTPUT)
-pi.write(ena_pin, enable)
-
-pi.set_mode(servo_pin, pigpio.OUTPUT)
-pi.set_PWM_frequency(servo_pin, 50)
-pi.set_mode(dc_pin, pigpio.OUTPUT)
-pi.write(dc_pin, 1)
-pi.set_mode(lmt_pin_1, pigpio.INPUT)
-pi.set_pull_up_down(lmt_pin_1, pigpio.PUD_UP)
-pi.set_mode(lmt_pin_2, pigpio.INPUT)
-pi.set_pull_up_down(lmt_pin_2, pigpio.PUD_UP)
-pi.set_mode(stop_pin, pigpio.INPUT)
-pi.set_pull_up_down(stop_pin, pigpio.PUD_UP)
-
-# Loading and dispensing angles for measure servo (degrees)
-load_angle = {
-    1:0,
-    2:31,
-    3:64.8,
-    4:101.3,
-    5:140.2,
-    }
-dispense_angle = {
-    1:15.5,
-    2:47.9,
-    3:83,
-    4:120.7,
-    5:160.9,
-    }
-# Offset for measuring disc (degrees)
-offset = 6
-
-
-"""
-Returns feeding day (1-5) when given day of week
-"""
-def get_day(i):
-    switcher={
-        0:5,    # Monday    (day 5)
-        1:1,    # Tuesday   (demo/testing)
-        2:1,    # Wednesday (demo/testing)
-        3:1,    # Thursday  (day 1)
-        4:2,    # Friday    (day 2)
-        5:3,    # Saturday  (day 3)
-        6:4,    # Sunday    (day 4)
-        }
-    return switcher.get(i, "invalid day")
-
-"""
-Quadratic ease in/out function.
-This eases the steppers up to full speed and back to rest
-to reduce strain and prevent missed steps.
-"""
-def easeinout(t):
-    b = wait*4      # initial wait time
-    c = wait - b    # change in wait time
-    d = ease_count  # number of steps over which to change wait time
-    
-    t /= d/2
-    if t < 1:
-        return c/2*t*t+b
-    t = t-1
-    return -c/2*(t*(t-2)-1)+b
-
-"""
-Homing function.
-The CVT uses limit switches on a single circuit to find home position.
-Once one arm is homed, it must back off the limit switch to open the
-circuit before homing the next arm.
-"""
-def home():
-    backup_degrees = -10    # Degrees to back up each arm
-    axis_1_degrees = 190    # Degrees to move first axis before failing
-    axis_2_degrees = 370    # Degrees to move second axis before failing
-
-    # Backup both axes before homing    
-    start_steps(int(backup_degrees*stepper_1_deg_to_step), 
-                int(backup_degrees*stepper_2_deg_to_step))
-    sleep(1)
-    
-    # Home second axis
-    for i in range(int(axis_2_degrees*stepper_2_deg_to_step)):
-        if pi.read(lmt_pin_2): break    # Axis homed
-        elif i < (int(axis_2_degrees*stepper_2_deg_to_step)):
-            step(step_pin_2, CCW)
-            sleep(wait)                 # Extra wait slows motor for homing
-        elif i == (int(axis_2_degrees*stepper_2_deg_to_step))-1:
-            shutdown("STEPPER 2 HOMING FAILED")
-    sleep(1)
-
-    # Home first axis
-    for i in range(int(axis_1_degrees*stepper_1_deg_to_step)):
-        if pi.read(lmt_pin_1): break     # Axis homed
-        elif i < (int(axis_1_degrees*stepper_1_deg_to_step)):
-            step(step_pin_1, CW)
-            sleep(wait)                 # Extra wait slows motor for homing
-        elif i == (int(axis_1_degrees*stepper_1_deg_to_step))-1:
-            shutdown("STEPPER 1 HOMING FAILED")
-    sleep(1)
-    
-    # Add calibration adjustment to both axes
-    start_steps(stepper_cal_1*step_mode, stepper_cal_2*step_mode)
-    sleep(1)
-
-"""
-Initiate stepper movement.
-The coordinates of the next jar in mm is calculated, then this
-is passed to the function to calculate the number of stepper motor
-steps to reach this position.
-"""
-def goto_coords(x, y):
-    # Add radius to get center of jar and subtract arm origin offset
-    x_coord = x*jar_diam + jar_diam/2 - ori_x
-    y_coord = y*jar_diam + jar_diam/2 - ori_y
-    get_step_counts(x_coord, y_coord)
-
-"""
-A reference is held to the current angle of steppers in degrees.
-The next stepper positions are calculated from the jar coordinates
-in mm and the difference between angles calculated.
-"""
-def get_step_counts(x, y):
-    global stepper_1, stepper_2
-    current_stepper_1, current_stepper_2 = stepper_1, stepper_2
-    
-    if x > 0:
-        stepper_1 = 180 - (math.degrees(math.atan(y/x)) \
-                    + math.degrees(math.acos((x*x + y*y + arm_1*arm_1 - arm_2*arm_2) \
-                    / (2*math.sqrt(y*y + x*x)*arm_1))))
-        stepper_2 = math.degrees(math.acos((arm_2*arm_2 + arm_1*arm_1 - x*x - y*y) \
-                    / (2*arm_1*arm_2)))
-    elif x < 0:
-        stepper_1 = math.degrees(math.atan(y/abs(x))) \
-                    + math.degrees(math.acos((x*x + y*y + arm_1*arm_1 - arm_2*arm_2) \
-                    / (2*math.sqrt(y*y + x*x)*arm_1)))
-        stepper_2 = 360 - math.degrees(math.acos((arm_2*arm_2 + arm_1*arm_1 - x*x - y*y) \
-                    / (2*arm_1*arm_2)))
-    elif x == 0:
-        stepper_1 = math.degrees(math.atan(y/1)) \
-                    + math.degrees(math.acos((1 + y*y + arm_1*arm_1 - arm_2*arm_2) \
-                    / (2*math.sqrt(y*y + 1)*arm_1)))
-        stepper_2 = 360 - math.degrees(math.acos((arm_2*arm_2 + arm_1*arm_1 - x*x - y*y) \
-                    / (2*arm_1*arm_2)))
-    
-    step_count_1 = int(stepper_1_deg_to_step * (current_stepper_1 - stepper_1))
-    step_count_2 = int(stepper_2_deg_to_step * (current_stepper_2 - stepper_2))
-    
-#    print("x=" + str(x) + ", y=" + str(y))
-#    print("angle_1=" + str(stepper_1) + ", angle_2=" + str(stepper_2))
-#    print("---------------------------------------------")
-    
-    start_steps(step_count_1, step_count_2)
-
-def start_steps(step_count_1, step_count_2):
-    # Create stepper threads
-    t1 = threading.Thread(target=step_thread, args=(1, step_count_1))
-    t2 = threading.Thread(target=step_thread, args=(2, step_count_2))
-
-    # Start stepper threads
-    t1.start()
-    t2.start()
-
-    # Wait until both threads have finished
-    t1.join()
-    t2.join()
-
-def step_thread(stepper, step_count):
-    i = 0           # Current step number
-
-    for s in range(abs(step_count)):
-        if stepper == 1:
-            if step_count > 0:
-                step(step_pin_1, CW)
-            elif step_count < 0:
-                step(step_pin_1, CCW)
-        elif stepper == 2:
-            if step_count > 0:
-                step(step_pin_2, CCW)
-            elif step_count < 0:
-                step(step_pin_2, CW)
-        
-        i += 1      # Increment step counter
-        
-        # Ease into and out of movement
-        if i <= ease_count and i < abs(step_count)/2:
-            sleep(easeinout(i)-wait)
-        elif i >= abs(step_count)-ease_count:
-            sleep(easeinout(abs(step_count)-i)-wait)
-
-def step(stepper, direction):
-    if stepper is step_pin_1: pi.write(dir_pin_1, direction)
-    elif stepper is step_pin_2: pi.write(dir_pin_2, direction)
-    
-    pi.write(stepper, 1)
-    pi.write(stepper, 0)
-    sleep(wait)
-
-def set_servo_angle(angle):
-    servo_wait = 70 / 1000
-    pw = angle * 2000/180 + 500
-    pi.set_servo_pulsewidth(servo_pin, pw)
-    sleep(servo_wait)
-    
-def vibrate(seconds):
-    pi.write(dc_pin, 0)
-    sleep(seconds)
-    pi.write(dc_pin, 1)
-    sleep(0.5)
-    
-def dispense(i):
-    # Load
-    set_servo_angle(load_angle[i] + offset)
-    sleep(0.5)
-    vibrate(0.5)
-
-    # Dispense
-    set_servo_angle(dispense_angle[i] + offset)
-    sleep(0.5)
-    vibrate(0.5)
-
-def stop_callback(gpio, level, tick):
-    for i in range(5):
-        sleep(0.1)
-        if pi.read(27): return
-            
-    shutdown("STOP BUTTON PRESSED")
-
-def shutdown(result):    
-    # Release motors
-    pi.write(ena_pin, disable)
-    sleep(1)        # Extra time before pigpio focus returns to daemon
-    pi.set_servo_pulsewidth(servo_pin, 0)
-    pi.write(dc_pin, 1)
-    pi.stop()       # Stop pigpio and return button input focus to daemon
-    
-    # Print report
-    print(str(datetime.datetime.now()) + ": " + result)
-    file = open("/home/pi/log.txt", "a+")
-    file.write("\n" + str(datetime.datetime.now()) + ": " + result)
-    file.close()
-    
-    # Log report on Google Sheets
-    call(['/usr/bin/python3', '/home/pi/cvt60/logger.py', unit_number, result])
-    
-    print("Shutdown complete.")
-    sleep(2)
-    sys.exit()
-
-
-try:
-    # Sleep to prevent start switch input from triggering stop callback
-    sleep(2)
-    
-    # Set callback to check for stop button press
-    cb = pi.callback(stop_pin, pigpio.FALLING_EDGE, stop_callback)
-    
-    # Get current feeding day
-    day = get_day(datetime.date.today().weekday())
-
-    # Home motors before beginning
-    home()
-    
-    # Go to predefined start position (x,y) before continuing cycle
-    # This is implemented to avoid dispenser hitting wall on the way to jar(0,0)
-    goto_coords(4, 4)
-
-    # Run main dispensing procedure
-    for x in range(jar_cols):
-        if x % 2 == 0:
-            for y in range(jar_rows):               # Forward for even-numbered columns
-                goto_coords(x, y)                   # Goto x/y coordinates of next jar
-                dispense(day)                       # Accepts day integer 1-5
-        else:
-            for y in range(jar_rows-1, -1, -1):     # Reverse for odd-numbered columns
-                goto_coords(x, y)                   # Go to x/y coordinates of next jar
-                dispense(day)                       # Accepts day integer 1-5
-
-    # Return steppers to home position
-    goto_coords(6, 4)
-    home()
-    
-    # Execute process cleanup and pass result as argument
-    shutdown("SUCCESS")
-    
-except:
-    shutdown(str(sys.exc_info()))
-
+#!/usr/bin/python3
+
+import armstate
+import asyncio
+import cycleplan
+import datetime
+import dosemap
+import gpiotrace
+import sys
+import threading
+import hardware
+import kinematics
+import logger
+import motion
+import motionprofile
+import route
+import scheduler
+import servo
+import spool
+import stepmonitor
+import timing
+import waveform
+from config import *
+from hardware import pigpio
+
+# Connection to pigpio, assigned by setup()
+pi = None
+
+# Initialize stepper positions (steps from home)
+stepper_1 = stepper_2 = 0
+
+CW = 0                  # Clockwise stepper movement
+CCW = 1                 # Counterclockwise stepper movement
+enable = 1              # Enable stepper
+disable = 0             # Disable stepper
+
+# Pin assignments. All numbers are BCM, not physical pin number.
+step_pin_1   =    21    # First axis stepper movement
+dir_pin_1    =    13    # First axis stepper direction
+step_pin_2   =    12    # Second axis stepper movement
+dir_pin_2    =    20    # Second axis stepper direction
+ena_pin      =    24    # Stepper enable via relay switch
+
+servo_pin    =    27    # Servo controlling measure plate, PWM at 50Hz
+dc_pin       =    4     # DC vibration motor
+lmt_pin_1    =    23    # Limit switch for homing first axis
+lmt_pin_2    =    22    # Limit switch for homing second axis
+stop_pin     =    2     # Stop button for halting program
+
+# Extra time allowed for a move beyond its planned duration (seconds)
+move_timeout = 2
+
+# Time for the arm to settle between homing moves (seconds)
+home_settle = 0.2
+
+# Steps a limit switch may close away from where it is expected when
+# verifying a saved position
+verify_tolerance = step_mode
+
+# Time from hardware.monotonic that the first step of the run was sent
+first_step = None
+
+# Whether the cart runs as a process of its own, started by the daemon,
+# rather than as a job inside it (see jobs). Only then does shutdown wait
+# for the daemon to take back the buttons.
+standalone = True
+
+# Time in us the stop button must be steady before a press counts
+stop_filter = 5000
+
+# Set to stop the run in progress, see request_stop()
+stop_request = None
+
+# Cancellation token, set from whichever thread first sees a stop, with
+# the result to report. Checked before every move and waveform block is
+# sent, so nothing moves after a stop.
+stopping = threading.Event()
+stop_reason = None
+
+# pigpio ticks of the stop request and of the motors being stopped
+stop_ticks = None
+
+# Compiled plan of the cycle being run, whose moves are replayed
+plan = None
+
+# Record the timing of every step pulse and check it against the
+# commanded moves (see stepmonitor)
+monitor_steps = False
+
+# Record every GPIO level change and servo pulse width of the run into
+# a binary trace (see gpiotrace)
+trace_gpio = False
+
+
+# Raised to end a cycle early, with the result to report as its message
+class CycleError(Exception):
+    pass
+
+"""
+Assign pigpio to Raspberry Pi and set up pins.
+"""
+def setup():
+    global pi
+    pi = pigpio.pi()
+    # Free waves left in pigpiod by a run that did not shut down cleanly
+    pi.wave_clear()
+
+    pi.set_mode(step_pin_1, pigpio.OUTPUT)
+    pi.write(step_pin_1, 0)
+    pi.set_mode(dir_pin_1, pigpio.OUTPUT)
+    pi.write(dir_pin_1, 0)
+    pi.set_mode(step_pin_2, pigpio.OUTPUT)
+    pi.write(step_pin_2, 0)
+    pi.set_mode(dir_pin_2, pigpio.OUTPUT)
+    pi.write(dir_pin_2, 0)
+    pi.set_mode(ena_pin, pigpio.OUTPUT)
+    pi.write(ena_pin, enable)
+
+    pi.set_mode(servo_pin, pigpio.OUTPUT)
+    pi.set_PWM_frequency(servo_pin, 50)
+    servo.release()
+    pi.set_mode(dc_pin, pigpio.OUTPUT)
+    pi.write(dc_pin, 1)
+    pi.set_mode(lmt_pin_1, pigpio.INPUT)
+    pi.set_pull_up_down(lmt_pin_1, pigpio.PUD_UP)
+    pi.set_mode(lmt_pin_2, pigpio.INPUT)
+    pi.set_pull_up_down(lmt_pin_2, pigpio.PUD_UP)
+    pi.set_mode(stop_pin, pigpio.INPUT)
+    pi.set_pull_up_down(stop_pin, pigpio.PUD_UP)
+    pi.set_glitch_filter(stop_pin, stop_filter)
+
+    if monitor_steps:
+        stepmonitor.start(pi, {step_pin_1: 1, step_pin_2: 2})
+    if trace_gpio:
+        gpiotrace.start(pi, [step_pin_1, dir_pin_1, step_pin_2, dir_pin_2, ena_pin,
+                             dc_pin, lmt_pin_1, lmt_pin_2, stop_pin])
+
+
+"""
+Returns feeding day (1-5) when given day of week
+"""
+def get_day(i):
+    switcher={
+        0:5,    # Monday    (day 5)
+        1:1,    # Tuesday   (demo/testing)
+        2:1,    # Wednesday (demo/testing)
+        3:1,    # Thursday  (day 1)
+        4:2,    # Friday    (day 2)
+        5:3,    # Saturday  (day 3)
+        6:4,    # Sunday    (day 4)
+        }
+    return switcher.get(i, "invalid day")
+
+async def home():
+    with timing.phase('home'):
+        await seek_home()
+
+"""
+Homing function.
+The CVT uses limit switches on a single circuit to find home position.
+Once one arm is homed, it must back off the limit switch to open the
+circuit before homing the next arm. Each axis seeks its switch at
+speed, backs off and approaches it again slowly for a precise home.
+"""
+async def seek_home():
+    global stepper_1, stepper_2
+    backup_degrees = -10    # Degrees to back up each arm
+    axis_1_degrees = 190    # Degrees to move first axis before failing
+    axis_2_degrees = 370    # Degrees to move second axis before failing
+
+    # Backup both axes off any closed limit switch before homing
+    if pi.read(lmt_pin_1) or pi.read(lmt_pin_2):
+        await start_steps(int(backup_degrees*stepper_1_deg_to_step),
+                          int(backup_degrees*stepper_2_deg_to_step))
+        await asyncio.sleep(home_settle)
+
+    # Home second axis, then first axis
+    await home_axis(2, int(axis_2_degrees*stepper_2_deg_to_step))
+    await home_axis(1, int(axis_1_degrees*stepper_1_deg_to_step))
+
+    # Add calibration adjustment to both axes
+    await start_steps(stepper_cal_1*step_mode, stepper_cal_2*step_mode)
+    await asyncio.sleep(home_settle)
+    stepper_1 = stepper_2 = 0
+
+"""
+Home one axis: seek the limit switch fast, back off it until it opens
+and approach it again slowly, so the switch is always reached at the
+same low speed. An arm already past its switch is backed off until it
+opens too. The axis moves at most max_steps either way.
+"""
+async def home_axis(axis, max_steps):
+    deg_to_step = stepper_1_deg_to_step if axis == 1 else stepper_2_deg_to_step
+    lmt_pin = lmt_pin_1 if axis == 1 else lmt_pin_2
+    backoff = int(home_backoff*deg_to_step)
+    failed = "STEPPER %d HOMING FAILED" % axis
+
+    if await seek_limit(axis, max_steps, home_fast_vel[axis]) is None:
+        raise CycleError(failed)
+    await asyncio.sleep(home_settle)
+    for tries in range(max(max_steps // backoff, 1)):
+        await start_steps(-backoff, 0) if axis == 1 else await start_steps(0, -backoff)
+        if not pi.read(lmt_pin):
+            break
+    else:
+        raise CycleError(failed)
+    if await seek_limit(axis, 2*backoff, home_slow_vel[axis]) is None:
+        raise CycleError(failed)
+    await asyncio.sleep(home_settle)
+
+"""
+Drive an axis toward its limit switch at vel steps per second, for at
+most max_steps steps. The steps are one hardware-timed waveform, and a
+pigpio edge callback stops it the moment the switch closes. An edge is
+only taken once the switch reads closed, so a glitch does not end the
+seek. Step edges are timestamped by their pigpio ticks, so the steps up
+to the tick the switch closed at are counted, and any sent before the
+waveform stopped are stepped back. Returns the number of steps to the
+switch, or None if it did not close.
+"""
+async def seek_limit(axis, max_steps, vel):
+    if axis == 1:
+        step_pin, lmt_pin = step_pin_1, lmt_pin_1
+        pi.write(dir_pin_1, CW)
+    else:
+        step_pin, lmt_pin = step_pin_2, lmt_pin_2
+        pi.write(dir_pin_2, CCW)
+
+    loop = asyncio.get_running_loop()
+    closed = asyncio.Event()
+    step_ticks = []
+    reached = None
+    def on_close(gpio, level, tick):
+        nonlocal reached
+        if reached is not None or not pi.read(lmt_pin):
+            return
+        pi.wave_tx_stop()
+        # Callbacks arrive in tick order, so every step up to the switch is in
+        reached = sum(1 for t in step_ticks if (tick - t) & 0xffffffff < 1 << 31)
+        loop.call_soon_threadsafe(closed.set)
+
+    limit_cb = pi.callback(lmt_pin, pigpio.RISING_EDGE, on_close)
+    step_cb = pi.callback(step_pin, pigpio.RISING_EDGE,
+                          lambda gpio, level, tick: step_ticks.append(tick))
+    try:
+        if pi.read(lmt_pin):
+            return 0
+
+        times, duration = motion.step_times(motionprofile.seek_delays(max_steps, axis, vel))
+        moving = asyncio.create_task(play(waveform.pulse_train({step_pin: times}, duration)))
+        stopped = asyncio.create_task(closed.wait())
+        try:
+            await asyncio.wait({moving, stopped}, timeout=duration/1000000 + move_timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in moving, stopped:
+                task.cancel()
+            await asyncio.gather(moving, stopped, return_exceptions=True)
+            # The wave may have stopped mid-pulse
+            pi.write(step_pin, 0)
+        if reached is None:
+            return None
+        overshoot = len(step_ticks) - reached
+        if overshoot:
+            await start_steps(-overshoot, 0) if axis == 1 else await start_steps(0, -overshoot)
+        return reached
+    finally:
+        limit_cb.cancel()
+        step_cb.cancel()
+
+"""
+Check the arm is where the last clean shutdown left it with a short
+touch of each limit switch, instead of a full homing sweep. Each switch
+must close within verify_tolerance steps of where it is expected.
+Falls back to full homing if either check fails.
+"""
+async def verify_home(position):
+    global stepper_1, stepper_2
+    with timing.phase('verify') as record:
+        stepper_1, stepper_2 = position
+        drift = await touch_limits()
+        record['drift'] = drift
+        if all(drift.get(axis) is not None and abs(drift[axis]) <= verify_tolerance
+               for axis in (1, 2)):
+            return
+        record['failed'] = True
+    await home()
+
+"""
+Move both axes just clear of their limit switches, approach the
+switches slowly and zero the axes from them. Returns {axis: steps} of
+how far from where it was expected each switch closed, which is the
+number of steps the axis has drifted. A switch that does not close, or
+is already closed so the arm is past it, gives None, and the axes are
+then left unzeroed.
+"""
+async def touch_limits():
+    global stepper_1, stepper_2
+    switch_1, switch_2 = stepper_cal_1*step_mode, stepper_cal_2*step_mode
+    backoff = {1:int(home_backoff*stepper_1_deg_to_step),
+               2:int(home_backoff*stepper_2_deg_to_step)}
+
+    await goto_steps(switch_1 + backoff[1], switch_2 + backoff[2])
+    drift = {}
+    for axis in 2, 1:
+        steps = await seek_limit(axis, 2*backoff[axis], home_slow_vel[axis])
+        drift[axis] = None if not steps else steps - backoff[axis]
+    if None in drift.values():
+        return drift
+
+    stepper_1, stepper_2 = switch_1, switch_2
+    await goto_steps(0, 0)
+    await asyncio.sleep(home_settle)
+    return drift
+
+"""
+Initiate stepper movement.
+The absolute step targets of the next jar are looked up in the
+precomputed jar table, so no kinematics are worked out during a cycle.
+"""
+async def goto_coords(x, y):
+    target_1, target_2 = kinematics.jar_steps(x, y)
+    with timing.phase('move', jar=[x, y], steps=[stepper_1 - target_1, stepper_2 - target_2]):
+        await goto_steps(target_1, target_2)
+
+"""
+A reference is held to the current position of steppers in steps
+from home. The steps to move are the difference from the target.
+"""
+async def goto_steps(target_1, target_2):
+    global stepper_1, stepper_2
+    step_count_1, step_count_2 = stepper_1 - target_1, stepper_2 - target_2
+    stepper_1, stepper_2 = target_1, target_2
+    await start_steps(step_count_1, step_count_2)
+
+"""
+Both axes are interpolated onto one timeline so they start and finish
+together, then compiled into one hardware-timed pigpio waveform,
+including the acceleration ramps, and played as a single unit.
+The move is stopped if it overruns its planned duration.
+"""
+async def start_steps(step_count_1, step_count_2):
+    check_stop()
+
+    # Set direction of each axis once for the whole move
+    pi.write(dir_pin_1, CW if step_count_1 > 0 else CCW)
+    pi.write(dir_pin_2, CCW if step_count_2 > 0 else CW)
+
+    # Moves of the cycle come precompiled from its plan
+    compiled = plan.pulses(step_count_1, step_count_2) if plan else None
+    pulses, duration = compiled or cycleplan.move_pulses(step_count_1, step_count_2,
+                                                         (step_pin_1, step_pin_2))
+
+    # Submit the move and wait until it has finished
+    start_tick = pi.get_current_tick()
+    await asyncio.wait_for(play(pulses), duration/1000000 + move_timeout)
+    check_stop()
+    if stepmonitor.active():
+        stepmonitor.add_move(start_tick, pi.get_current_tick(), pulses)
+
+"""
+Play a pulse train, noting when the first one of the run was sent.
+"""
+def play(pulses):
+    global first_step
+    if first_step is None:
+        first_step = hardware.monotonic()
+    return waveform.play(pi, pulses, stopping)
+
+"""
+Turn the measure plate and wait until it is there (see servo).
+"""
+async def set_servo_angle(angle):
+    for pw, wait in servo.move(angle):
+        check_stop()
+        set_servo_pulsewidth(pw)
+        await asyncio.sleep(wait)
+
+def release_servo():
+    set_servo_pulsewidth(0)
+    servo.release()
+
+def set_servo_pulsewidth(pw):
+    pi.set_servo_pulsewidth(servo_pin, pw)
+    gpiotrace.servo(pi, servo_pin, pw)
+    
+async def vibrate(seconds):
+    with timing.phase('vibrate'):
+        check_stop()
+        pi.write(dc_pin, 0)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            pi.write(dc_pin, 1)
+        await asyncio.sleep(vibrate_settle)
+    
+"""
+Dispensing is split in two so loading the measure plate for the next
+jar can overlap with the arm travelling to it. Only the release has to
+wait for the arm to arrive.
+"""
+async def load(plan, day):
+    with timing.phase('load', day=day):
+        await set_servo_angle(plan.servo[day][0])
+        await asyncio.sleep(load_dwell)
+        await vibrate(plan.vibrate)
+
+async def release(plan, day):
+    with timing.phase('release', day=day):
+        await set_servo_angle(plan.servo[day][1])
+        await asyncio.sleep(dispense_dwell)
+        await vibrate(plan.vibrate)
+
+"""
+Move to a jar and dispense its dose into it.
+Loading runs as a separate task while the arm travels. It holds the
+servo and vibration motor, and the move holds the steppers. The
+release holds all three, so feed is never released while the arm is
+moving and the arm never leaves before the release has finished.
+"""
+async def feed_jar(x, y, plan):
+    day = plan.doses[x, y]
+    with timing.phase('jar', jar=[x, y], day=day):
+        loading = scheduler.submit({'servo', 'dc'}, load, plan, day)
+        try:
+            await scheduler.run({'steppers'}, goto_coords, x, y)
+            await loading
+        finally:
+            loading.cancel()
+        await scheduler.run({'steppers', 'servo', 'dc'}, release, plan, day)
+
+"""
+Predicted seconds saved by skipping the jars left out of a plan: the
+shorter route, plus the time spent dispensing at each skipped jar,
+taken from the jars fed so far this run.
+"""
+def skip_saving(plan):
+    skipped = jar_cols*jar_rows - len(plan.jars)
+    dispensing, fed, move = 0, 0, None
+    # Each jar record follows the record of its own move
+    for record in timing.records:
+        if record['phase'] == 'move':
+            move = record['end'] - record['start']
+        elif record['phase'] == 'jar' and move is not None:
+            dispensing += record['end'] - record['start'] - move
+            fed += 1
+    per_jar = dispensing/fed if fed else 0
+    return plan.full_move_time - plan.move_time + skipped*per_jar
+
+"""
+Move to a jar from another jar, or from home if start is None, passing
+any jars needed to keep clear of the walls.
+"""
+async def travel(start, jar):
+    for via in route.vias(start, jar):
+        await goto_coords(*via)
+    await goto_coords(*jar)
+
+"""
+Move from a jar to one that homing is clear of the walls from.
+"""
+async def leave(jar):
+    for via in route.exit_vias(jar):
+        await goto_coords(*via)
+
+"""
+Full feeding cycle. Returns the result to report.
+If the position of the arm is known from the last run it is only
+verified, otherwise the arm is fully homed first. Every jar gets the
+day's dose unless the cart's dose map gives it another or skips it.
+The cycle replays the compiled plan for those doses, which is loaded
+(or compiled if the doses or configuration changed) while the arm homes.
+"""
+async def run_cycle(day, position=None):
+    global plan
+    plan = None
+    doses = dosemap.doses(day)
+    loop = asyncio.get_running_loop()
+    planning = loop.run_in_executor(None, cycleplan.load, doses, (step_pin_1, step_pin_2))
+
+    # Home motors before beginning
+    if position is None:
+        await home()
+    else:
+        await verify_home(position)
+    plan = await planning
+    if not plan.jars:
+        # Every jar is skipped today and the arm is already home
+        timing.annotate(jars_fed=0, skip_saving=round(skip_saving(plan), 3))
+        return "SUCCESS"
+
+    # Run main dispensing procedure, visiting the jars to feed in the
+    # order with the shortest total move time. Jars are passed on the way
+    # where a direct move would take the dispenser into a wall.
+    for (x, y), feed in plan.path:
+        if feed:
+            await feed_jar(x, y, plan)
+        else:
+            await goto_coords(x, y)
+    timing.annotate(jars_fed=len(plan.jars), skip_saving=round(skip_saving(plan), 3))
+
+    # Return steppers to home position
+    await home()
+    return "SUCCESS"
+
+"""
+Stop all motion at once: abort the waveform, disable the steppers and
+stop the vibration motor, then set the cancellation token. Safe to call
+from any thread; only the first stop of a run counts. tick is the
+pigpio tick the stop was asked for at, if it is already known.
+"""
+def emergency_stop(reason, tick=None):
+    global stop_reason, stop_ticks
+    if stopping.is_set():
+        return
+    if tick is None:
+        tick = pi.get_current_tick()
+    pi.wave_tx_stop()
+    pi.write(ena_pin, disable)
+    pi.write(dc_pin, 1)
+    stop_reason = reason
+    stop_ticks = (tick, pi.get_current_tick())
+    stopping.set()
+
+"""
+Raise the stop as a CycleError if the run has been stopped.
+"""
+def check_stop():
+    if stopping.is_set():
+        raise CycleError(stop_reason)
+
+"""
+Time in ms from the stop request to the motors being stopped, or None
+if the run was not stopped. No pulse is sent once the waveform has been
+aborted, so this bounds the time to the last step. A button press is
+only reported once it has passed the glitch filter, so its latency
+includes the filter time.
+"""
+def stop_latency():
+    if stop_ticks is None:
+        return None
+    requested, stopped = stop_ticks
+    latency = ((stopped - requested) & 0xffffffff) / 1000
+    if stop_reason == "STOP BUTTON PRESSED":
+        latency += stop_filter / 1000
+    return latency
+
+"""
+Wait for the stop button to be pressed.
+The pigpio callback that sees the press stops the arm itself, so the
+stop does not wait on the event loop. Presses are debounced by the
+stop_filter glitch filter. The run button doubles as the stop button,
+so the press that started the run is ignored until the button has been
+let go.
+"""
+async def watch_stop_button():
+    loop = asyncio.get_running_loop()
+    pressed = asyncio.Event()
+    armed = False
+    def on_press(gpio, level, tick):
+        if armed:
+            emergency_stop("STOP BUTTON PRESSED", tick)
+            loop.call_soon_threadsafe(pressed.set)
+
+    cb = pi.callback(stop_pin, pigpio.FALLING_EDGE, on_press)
+    try:
+        while not pi.read(stop_pin):
+            await asyncio.sleep(0.1)
+        armed = True
+        await pressed.wait()
+    finally:
+        cb.cancel()
+
+"""
+Write the result to the local log and queue it for Google Sheets.
+The result is shipped in the background, by the process's own shipper
+if it has one or else by a detached logger.py, so the cycle never waits
+on the network. Simulated runs are only printed.
+"""
+async def report(result):
+    # Print report
+    print(str(datetime.datetime.now()) + ": " + result)
+    run = timing.records[0] if timing.records else {}
+    if stop_latency() is not None:
+        print("Stop latency: %.3f ms" % stop_latency())
+    if run.get('jars_fed', jar_cols*jar_rows) < jar_cols*jar_rows:
+        print("Fed %d of %d jars, saving %.1f s" % (run['jars_fed'], jar_cols*jar_rows,
+                                                    run['skip_saving']))
+    if hardware.simulated:
+        return
+    file = open("/home/pi/log.txt", "a+")
+    file.write("\n" + str(datetime.datetime.now()) + ": " + result)
+    file.close()
+    
+    # Log report on Google Sheets
+    spool.add(unit_number, result, timing.summary())
+    if logger.running():
+        logger.notify()
+    else:
+        await asyncio.create_subprocess_exec('/usr/bin/python3', '/home/pi/cvt60/logger.py',
+                                             start_new_session=True)
+
+async def shutdown(result):    
+    # Release motors
+    pi.write(ena_pin, disable)
+    if standalone:
+        await asyncio.sleep(1)  # Extra time before pigpio focus returns to daemon
+    release_servo()
+    pi.write(dc_pin, 1)
+    # Every step callback has arrived by now
+    if stepmonitor.active():
+        stepmonitor.stop()
+        timing.annotate(step_timing=stepmonitor.summary())
+    if gpiotrace.active():
+        timing.annotate(gpio_trace=gpiotrace.stop())
+    pi.stop()       # Stop pigpio and return button input focus to daemon
+
+    # Only a completed cycle ends homed, so the next run can trust it
+    if result == "SUCCESS":
+        armstate.save(stepper_1, stepper_2)
+
+    timing.finish(result)
+    await report(result)
+    
+    print("Shutdown complete.")
+    if standalone:
+        await asyncio.sleep(2)
+
+"""
+Stop the run in progress as if the stop button was pressed. Must be
+called from the thread running the event loop.
+"""
+def request_stop():
+    if stop_request is not None:
+        emergency_stop("CYCLE CANCELLED")
+        stop_request.set()
+
+"""
+Run a coroutine alongside the stop button monitor. Whichever finishes
+first ends the run. A stop has already halted the arm; the coroutine is
+then cancelled to clean up. Returns the result to report.
+"""
+async def run_until_stopped(coroutine):
+    global stop_request, stop_reason, stop_ticks
+    stopping.clear()
+    stop_reason = stop_ticks = None
+    stop_request = asyncio.Event()
+    task = asyncio.create_task(coroutine)
+    stop = asyncio.create_task(watch_stop_button())
+    requested = asyncio.create_task(stop_request.wait())
+    done, pending = await asyncio.wait({task, stop, requested},
+                                       return_when=asyncio.FIRST_COMPLETED)
+    for t in pending:
+        t.cancel()
+    await asyncio.gather(task, stop, requested, return_exceptions=True)
+    stop_request = None
+
+    if stopping.is_set():
+        timing.annotate(stop_latency_ms=stop_latency())
+        return stop_reason
+    if task.cancelled():
+        return "CYCLE CANCELLED"
+    try:
+        return task.result()
+    except CycleError as e:
+        return str(e)
+    except Exception:
+        return str(sys.exc_info())
+
+"""
+Run today's feeding cycle from setup to shutdown. job is the id of the
+job running it, if any (see jobs), which is stored in the run record.
+Returns the result.
+"""
+async def main(job=None):
+    global first_step
+    setup()
+    first_step = None
+
+    # Get current feeding day
+    day = get_day(datetime.date.today().weekday())
+    timing.start_run(unit=unit_number, day=day, job=job)
+
+    # Arm position saved by the last clean shutdown, if any. It is removed
+    # until this run also shuts down cleanly.
+    position = armstate.load()
+    armstate.clear()
+
+    result = await run_until_stopped(run_cycle(day, position))
+
+    # Execute process cleanup and pass result as argument
+    await shutdown(result)
+    return result
+
+if __name__ == '__main__':
+    hardware.run(main())
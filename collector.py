@@ -0,0 +1,320 @@
+#!/usr/bin/python3
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from time import perf_counter
+import httpserve
+import logger
+
+# Fleet telemetry collector. Units post their results and cycle timings
+# here (see collector_url in config) instead of each writing to the
+# shared sheet. Results are deduplicated by key, rolled up per unit and
+# appended to the sink in batches. A post is only answered once its new
+# results are in a local journal, as a unit marks what it posted as
+# shipped. Rows leave the journal once the sink has them, and rows left
+# in it by a restart are flushed again.
+#
+# Usage: collector.py                 serve, flushing to Google Sheets
+#        collector.py file <path>     serve, flushing to a JSONL file
+#        collector.py loadtest [n]    load test with n simulated units
+
+# Port the collector listens on
+port = 8060
+
+# Time between flushes to the sink in seconds
+flush_interval = 30
+
+# Most rows sent to the sink in one write
+batch_size = 500
+
+# Local database holding accepted rows until they are flushed
+journal_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'collector.db')
+
+# Number of result keys remembered for dropping duplicates
+seen_max = 1000000
+
+# Keys of results already received, oldest first
+seen = OrderedDict()
+
+# Rows waiting to be flushed to the sink
+batch = []
+
+# Totals of each unit's results
+rollups = {}
+
+# Connection to the journal, opened by open_journal()
+journal = None
+
+def reset():
+    seen.clear()
+    batch.clear()
+    rollups.clear()
+
+def open_journal(path=None):
+    global journal
+    journal = sqlite3.connect(path or journal_path)
+    journal.execute('PRAGMA journal_mode=WAL')
+    journal.execute('PRAGMA synchronous=FULL')
+    journal.execute('CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row TEXT)')
+    return journal
+
+"""
+Add results posted by a unit, as dicts of key, date, time, unit, result
+and optional data with cycle timings. Results whose key has been seen
+before are dropped. New results are in the journal by the time this
+returns. Returns the number of new results.
+"""
+def receive(results):
+    # Read every result first so a malformed post adds nothing
+    try:
+        rows = [[r['date'], r['time'], r['unit'], r['result'], r['key']] for r in results]
+        if not all(valid_data(r.get('data')) for r in results):
+            raise TypeError
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError("Malformed results")
+
+    new, keys = [], set()
+    for row, result in zip(rows, results):
+        if row[4] in seen or row[4] in keys:
+            continue
+        keys.add(row[4])
+        new.append((row, result))
+
+    with journal:
+        journal.executemany('INSERT OR IGNORE INTO rows (key, row) VALUES (?, ?)',
+                            [(row[4], json.dumps(row)) for row, result in new])
+    for row, result in new:
+        remember(row[4])
+        batch.append(row)
+        roll_up(result)
+    return len(new)
+
+"""
+Whether the data of a result can be rolled up: none, or a dict with an
+optional duration and a dict of phase times, all in seconds.
+"""
+def valid_data(data):
+    if data is None:
+        return True
+    if not isinstance(data, dict):
+        return False
+    number = lambda value: isinstance(value, (int, float))
+    phases = data.get('phases') or {}
+    return (data.get('duration') is None or number(data['duration'])) and \
+        isinstance(phases, dict) and all(number(seconds) for seconds in phases.values())
+
+def remember(key):
+    seen[key] = None
+    if len(seen) > seen_max:
+        seen.popitem(last=False)
+
+def roll_up(result):
+    rollup = rollups.setdefault(result['unit'], dict(runs=0, successes=0, duration=0.0,
+                                                    phases={}, last_date=None, last_result=None))
+    rollup['runs'] += 1
+    rollup['successes'] += result['result'] == 'SUCCESS'
+    data = result.get('data') or {}
+    rollup['duration'] += data.get('duration') or 0
+    for name, seconds in (data.get('phases') or {}).items():
+        rollup['phases'][name] = rollup['phases'].get(name, 0) + seconds
+
+    date = result['date'] + ' ' + result['time']
+    if rollup['last_date'] is None or date >= rollup['last_date']:
+        rollup['last_date'], rollup['last_result'] = date, result['result']
+
+"""
+Rollups of every unit, with mean cycle duration and phase times.
+"""
+def report():
+    units = {}
+    for unit, rollup in rollups.items():
+        runs = rollup['runs']
+        units[unit] = dict(runs=runs, successes=rollup['successes'],
+                           last_date=rollup['last_date'], last_result=rollup['last_result'],
+                           mean_duration=round(rollup['duration']/runs, 3),
+                           mean_phases={name: round(seconds/runs, 3)
+                                        for name, seconds in rollup['phases'].items()})
+    return units
+
+def handle(method, path, body):
+    if method == 'POST' and path == '/results':
+        results = json.loads(body)
+        accepted = receive(results)
+        response = dict(accepted=accepted, duplicates=len(results) - accepted)
+        return 200, 'application/json', json.dumps(response).encode()
+    if method == 'GET' and path == '/rollups':
+        return 200, 'application/json', json.dumps(report()).encode()
+    return 404, 'text/plain', b'Not found\n'
+
+"""
+Appends rows to the Google Sheets log.
+"""
+class SheetSink:
+    def __init__(self):
+        self.sheet = None
+
+    def open(self):
+        if self.sheet is None:
+            self.sheet = logger.open_sheet()
+        return self.sheet
+
+    def keys(self):
+        return self.open().col_values(logger.key_column)
+
+    def write(self, rows):
+        try:
+            self.open().append_rows(rows)
+        except Exception:
+            self.sheet = None
+            raise
+
+"""
+Appends rows to a file, one JSON list per line.
+"""
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def keys(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as file:
+            return [json.loads(line)[4] for line in file if line.strip()]
+
+    def write(self, rows):
+        with open(self.path, 'a') as file:
+            file.write(''.join(json.dumps(row) + '\n' for row in rows))
+
+class MemorySink:
+    def __init__(self):
+        self.rows = []
+        self.writes = 0
+
+    def keys(self):
+        return [row[4] for row in self.rows]
+
+    def write(self, rows):
+        self.rows += rows
+        self.writes += 1
+
+"""
+Write all waiting rows to the sink in batches, removing them from the
+journal once written. Writes run in a thread so the server keeps
+answering units while the sink is slow.
+"""
+async def flush(sink):
+    loop = asyncio.get_running_loop()
+    while batch:
+        rows = batch[:batch_size]
+        await loop.run_in_executor(None, sink.write, rows)
+        forget(rows)
+        del batch[:len(rows)]
+
+def forget(rows):
+    with journal:
+        journal.executemany('DELETE FROM rows WHERE key = ?', [(row[4],) for row in rows])
+
+"""
+Queue the rows left in the journal by the last run, except any the sink
+already has, which were written but not yet removed. Takes the keys in
+the sink.
+"""
+def recover(logged):
+    rows = [json.loads(row) for row, in journal.execute('SELECT row FROM rows ORDER BY rowid')]
+    forget([row for row in rows if row[4] in logged])
+    for row in rows:
+        if row[4] not in logged:
+            remember(row[4])
+            batch.append(row)
+
+async def flush_loop(sink, interval=None):
+    while True:
+        await asyncio.sleep(interval or flush_interval)
+        try:
+            await flush(sink)
+        except Exception as e:
+            # Rows stay in the batch for the next flush
+            print("Flush failed: " + str(e))
+
+"""
+Serve units until stopped. Keys already in the sink are remembered
+first, so results resent after a restart are not duplicated, and rows
+left in the journal are queued again.
+"""
+async def serve(sink, host='0.0.0.0', port=port):
+    loop = asyncio.get_running_loop()
+    logged = set(await loop.run_in_executor(None, sink.keys))
+    for key in logged:
+        remember(key)
+    open_journal()
+    recover(logged)
+    server = await httpserve.serve(handle, host, port)
+    async with server:
+        await flush_loop(sink)
+
+"""
+Load test with a simulated fleet. Every unit posts runs results
+concurrently with the others, resending every fifth one to exercise
+deduplication. Returns statistics of the test.
+"""
+async def load_test(units=300, runs=10):
+    reset()
+    sink = MemorySink()
+    directory = tempfile.TemporaryDirectory()
+    open_journal(os.path.join(directory.name, 'collector.db'))
+    server = await httpserve.serve(handle, '127.0.0.1', 0)
+    host, test_port = server.sockets[0].getsockname()[:2]
+    flushing = asyncio.create_task(flush_loop(sink, 0.1))
+    latencies = []
+
+    async def post(results):
+        start = perf_counter()
+        status, body = await httpserve.request(host, test_port, 'POST', '/results',
+                                               json.dumps(results).encode())
+        latencies.append(perf_counter() - start)
+        assert status == 200, body
+
+    async def unit(n):
+        for i in range(runs):
+            result = dict(key='%03d-2026-01-01 00:00:%02d' % (n, i), date='2026-01-01',
+                          time='00:00:%02d' % i, unit='%03d' % n, result='SUCCESS',
+                          data=dict(duration=250.0 + i, phases={'move': 90.0, 'home': 5.0}))
+            await post([result])
+            if i % 5 == 0:
+                await post([result])
+
+    start = perf_counter()
+    await asyncio.gather(*(unit(n) for n in range(units)))
+    elapsed = perf_counter() - start
+    flushing.cancel()
+    await flush(sink)
+    server.close()
+    await server.wait_closed()
+
+    assert len(sink.rows) == units*runs
+    assert len({row[4] for row in sink.rows}) == units*runs
+    assert all(rollup['runs'] == runs for rollup in rollups.values())
+    assert not journal.execute('SELECT COUNT(*) FROM rows').fetchone()[0]
+    journal.close()
+    directory.cleanup()
+    return dict(units=units, requests=len(latencies), seconds=round(elapsed, 3),
+                requests_per_s=round(len(latencies)/elapsed, 1),
+                p50_ms=round(float(np.percentile(latencies, 50))*1000, 2),
+                p99_ms=round(float(np.percentile(latencies, 99))*1000, 2),
+                rows=len(sink.rows), sink_writes=sink.writes)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['loadtest']:
+        units = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+        print(json.dumps(asyncio.run(load_test(units)), indent=2))
+    elif sys.argv[1:2] == ['file']:
+        asyncio.run(serve(FileSink(sys.argv[2])))
+    else:
+        asyncio.run(serve(SheetSink()))
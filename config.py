@@ -0,0 +1,135 @@
+# Configuration of a CVT60 unit, shared by the cart and planning modules
+
+import json
+
+# Serial number of CVT60 unit
+unit_number = '001'
+
+# Address of the fleet telemetry collector results are sent to
+# (e.g. 'http://192.168.1.10:8060'), or None to log straight to Google Sheets
+collector_url = None
+
+# Step adjustment to bring axes parallel with wall when homed
+# (positive = toward wall, negative = away from wall)
+stepper_cal_1, stepper_cal_2 = 5, 10
+
+# Number of microsteps per full step (e.g. half step = 2)
+step_mode = 8
+
+# Number of columns and rows of jars on cart
+jar_cols, jar_rows = 11, 7
+
+# Diameter of jars in mm
+jar_diam = 78
+
+# Location of arm shoulder axis relative to jars in mm
+ori_x = jar_cols*jar_diam / 2
+ori_y = -6
+
+# Length of arm sections in mm
+arm_1, arm_2 = 330, 330
+
+# Coefficient for converting degrees to steps
+# (pulley tooth count/motor tooth count * steps per revolution/360)
+stepper_1_deg_to_step = 116/20 * 200/360 * step_mode
+stepper_2_deg_to_step = 80/20 * 200/360 * step_mode
+
+# Velocity profile used for moves ('trapezoid' or 'scurve')
+motion_profile = 'trapezoid'
+
+# Speed each axis starts and stops at, in steps per second
+start_vel = {
+    1:250 * step_mode/8,
+    2:250 * step_mode/8,
+    }
+# Maximum speed of each axis in steps per second
+max_vel = {
+    1:1000 * step_mode/8,
+    2:1000 * step_mode/8,
+    }
+# Maximum acceleration of each axis in steps per second squared
+max_acc = {
+    1:3000 * step_mode/8,
+    2:3000 * step_mode/8,
+    }
+# Maximum jerk of each axis in steps per second cubed (scurve only)
+max_jerk = {
+    1:30000 * step_mode/8,
+    2:30000 * step_mode/8,
+    }
+
+# Factor applied to max_vel and max_acc of each axis. speedtune.py finds
+# the fastest this unit runs without losing steps and saves it in
+# tuning_path, which is read here when it exists.
+tuning_path = '/home/pi/cvt60_tuning.json'
+
+def tuned_scale():
+    try:
+        with open(tuning_path) as tuning:
+            return {int(axis): scale for axis, scale in json.load(tuning)['speed_scale'].items()}
+    except (OSError, ValueError, KeyError, AttributeError):
+        return {1:1, 2:1}
+
+speed_scale = tuned_scale()
+max_vel = {axis: max_vel[axis]*speed_scale[axis] for axis in max_vel}
+max_acc = {axis: max_acc[axis]*speed_scale[axis] for axis in max_acc}
+
+# Homing speeds in steps per second. Each axis seeks its limit switch
+# fast, backs off by home_backoff degrees and approaches again slowly
+home_fast_vel = {
+    1:1000 * step_mode/8,
+    2:1000 * step_mode/8,
+    }
+home_slow_vel = {
+    1:125 * step_mode/8,
+    2:125 * step_mode/8,
+    }
+home_backoff = 3
+
+# Loading and dispensing angles for measure servo (degrees)
+load_angle = {
+    1:0,
+    2:31,
+    3:64.8,
+    4:101.3,
+    5:140.2,
+    }
+dispense_angle = {
+    1:15.5,
+    2:47.9,
+    3:83,
+    4:120.7,
+    5:160.9,
+    }
+# Offset for measuring disc (degrees)
+offset = 6
+
+# Time the vibration motor runs to settle feed when loading and
+# dispensing (seconds)
+vibrate_time = 0.5
+
+# Speed the measure plate servo turns at (degrees per second) and the
+# time it takes to settle once there (seconds). The settle time is
+# shorter when the pulse width is ramped, as the servo then follows the
+# ramp instead of overshooting a jump.
+servo_slew = 500
+servo_settle = 0.03
+servo_ramp = False
+servo_ramp_settle = 0.01
+
+# Time feed is given to fall into the measure plate once it is at its
+# load angle, and out of it at its dispense angle, and to settle after
+# vibrating (seconds). Measured for each unit.
+load_dwell = 0.5
+dispense_dwell = 0.5
+vibrate_settle = 0.5
+
+# Walls the dispenser and elbow must keep clear of, in mm relative to
+# the arm shoulder axis: the side walls at each end of the rows of jars
+# and the back wall behind the shoulder. The front of the cart is open.
+wall_x = ori_x
+wall_y = -40
+
+# Radius of the dispenser and of the elbow joint in mm
+dispenser_radius = 30
+elbow_radius = 30
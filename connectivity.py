@@ -0,0 +1,66 @@
+import threading
+import requests
+from time import monotonic
+
+# Background check of the internet connection. Probes run in their own
+# thread over one persistent session and publish their result in the
+# module variables below, which readers such as the LED loop only read.
+
+url = 'http://clients3.google.com/generate_204'
+
+# Time allowed for a probe in seconds
+probe_timeout = 5
+
+# Seconds between probes while online. Starts at the first and doubles
+# after every success up to the second.
+healthy_interval = (5, 120)
+
+# Seconds between probes while offline or not yet known
+degraded_interval = 2
+
+# Result of the last probe: None before the first, then True or False
+online = None
+
+# monotonic() time of the last probe, its latency in seconds and the
+# number of probes failed in a row
+checked = None
+latency = None
+failures = 0
+
+# Set to stop the monitor
+stop = threading.Event()
+
+"""
+Check the connection once. Returns True if the probe url answered.
+"""
+def probe(session):
+    global online, checked, latency, failures
+    start = monotonic()
+    try:
+        ok = session.get(url, timeout=probe_timeout).status_code == 204
+    except requests.RequestException:
+        ok = False
+    checked = monotonic()
+    latency = checked - start
+    failures = 0 if ok else failures + 1
+    online = ok
+    return ok
+
+"""
+Probe until stopped. Probes slow down while the connection stays up
+and speed up as soon as it drops.
+"""
+def run():
+    session = requests.Session()
+    interval = healthy_interval[0]
+    while not stop.is_set():
+        if probe(session):
+            wait, interval = interval, min(2*interval, healthy_interval[1])
+        else:
+            wait, interval = degraded_interval, healthy_interval[0]
+        stop.wait(wait)
+    session.close()
+
+def start():
+    stop.clear()
+    threading.Thread(target=run, name='connectivity', daemon=True).start()
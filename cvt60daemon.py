@@ -2,17 +2,28 @@
 
 import pigpio
 import os
-import subprocess
+import threading
 import board
+import cart
+import connectivity
+import jobs
+import logger
+import metrics
 import neopixel
-import requests
-from time import sleep
+from time import sleep, monotonic
 
 enable = 1          # Enable stepper
 disable = 0         # Disable stepper
 
 pi = pigpio.pi()
 
+# Time in seconds the run button must be held to start a cycle. Stop
+# presses during a cycle only need to pass the glitch filter.
+run_hold = 0.5
+
+# Edges seen on the run button, so a pending start can tell it was let go
+run_edges = 0
+
 # Pin assignments. All numbers are BCM, not physical pin number.
 run_pin     =   2   # Run button
 sd_pin      =   3   # Shutdown button
@@ -23,6 +34,9 @@ dc_pin      =   4   # DC vibration motor
 # Set up pins and ensure motors are disabled at startup
 pi.set_mode(run_pin, pigpio.INPUT)
 pi.set_pull_up_down(run_pin, pigpio.PUD_UP)
+# The run button doubles as the cart's stop button, so it is debounced
+# by the same glitch filter the cart sets on it
+pi.set_glitch_filter(run_pin, cart.stop_filter)
 pi.set_mode(sd_pin, pigpio.INPUT)
 pi.set_pull_up_down(sd_pin, pigpio.PUD_UP)
 pi.set_mode(ena_pin, pigpio.OUTPUT)
@@ -37,10 +51,13 @@ pixels = neopixel.NeoPixel(board.D18, 8, brightness=0.5, auto_write=False)
 pixels.fill((0,0,0))
 pixels.show()
 
-# Set hue of led bar (0-255)
-rgb = (255,200,0)
-
-url = 'http://clients3.google.com/generate_204'
+# Hue of led bar (0-255) while the connection is unknown, up and down
+colors = {
+    None:(255,200,0),
+    True:(40,255,0),
+    False:(255,0,0),
+    }
+rgb = colors[None]
 
 def pulse(wait):
     global rgb
@@ -51,12 +68,8 @@ def pulse(wait):
         sleep(wait)
     sleep(1)
     
-    try:
-        response = requests.get(url, timeout=5)
-        if response.status_code == 204:
-            rgb = (40,255,0)
-    except:
-        rgb = (255,0,0)
+    # Show the latest connection status, checked in the background
+    rgb = colors[connectivity.online]
     
     for i in range(255,-1,-2):
         pixels.fill((rgb[0]*i//255,rgb[1]*i//255,rgb[2]*i//255))
@@ -67,6 +80,9 @@ def shutdown_callback(gpio, level, tick):
     for i in range(20):
         sleep(0.1)
         if pi.read(sd_pin): return
+    # Stop any cycle in progress so its motors are disabled first
+    jobs.cancel()
+    jobs.wait(10)
     pixels.fill((0,0,0))
     pixels.show()
     sleep(0.5)
@@ -74,14 +90,39 @@ def shutdown_callback(gpio, level, tick):
     os.system("sudo shutdown now -h")
 
 def run_callback(gpio, level, tick):
-    for i in range(5):
-        sleep(0.1)
-        if pi.read(run_pin): return
-    subprocess.call(['/usr/bin/python3', '/home/pi/cvt60/cart.py'])
+    global run_edges
+    run_edges += 1
+    # A press while a cycle is running is a stop, which the cycle handles
+    if level or jobs.running(): return
+    # The press is reported once the button has been steady for the filter time
+    pressed = monotonic() - cart.stop_filter / 1000000
+    threading.Timer(run_hold, start_cycle, (run_edges, pressed)).start()
+
+# Start a cycle if the run button has been held since the press
+def start_cycle(edges, pressed):
+    if edges == run_edges and not pi.read(run_pin):
+        jobs.submit(pressed)
+
+# Check the internet connection in the background for the led bar
+connectivity.start()
+
+# Keep the cart engine loaded and run cycles in this process
+jobs.start()
+
+# Ship logged results to Google Sheets in the background
+logger.start()
+
+# Serve run, shipping and connectivity metrics at /metrics from a
+# thread of their own. The daemon runs on without them if the port is
+# taken.
+try:
+    metrics.start()
+except OSError as e:
+    print("Metrics not served: " + str(e))
 
 # Set button callbacks
 cb1 = pi.callback(sd_pin, pigpio.FALLING_EDGE, shutdown_callback)
-cb2 = pi.callback(run_pin, pigpio.FALLING_EDGE, run_callback)
+cb2 = pi.callback(run_pin, pigpio.EITHER_EDGE, run_callback)
 
 try:
     while True:
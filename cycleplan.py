@@ -0,0 +1,132 @@
+import os
+import hashlib
+import numpy as np
+import config
+import kinematics
+import motion
+import motionprofile
+import route
+import waveform
+import workspace
+
+# A feeding cycle is fully determined by the unit configuration and the
+# dose of each jar, so it is compiled once into a plan: the jars to feed
+# in visiting order with their doses and any jars passed on the way to
+# keep clear of the walls, the servo and vibration settings, and the
+# pulse train of every move. Plans are stored on disk under a hash of
+# their inputs, and the cart replays them instead of planning and
+# compiling while it runs.
+
+# Directory holding compiled plans
+plan_dir = kinematics.table_dir
+
+# Changed whenever the layout of a plan or the way it is compiled changes
+plan_version = 5
+
+"""
+Pulse train and duration in us of a coordinated move, with the step
+pins of both axes given as pins.
+"""
+def move_pulses(step_count_1, step_count_2, pins):
+    times_1, times_2, duration = motion.coordinate(motionprofile.delays(step_count_1, 1),
+                                                   motionprofile.delays(step_count_2, 2))
+    return waveform.pulse_train({pins[0]: times_1, pins[1]: times_2}, duration), duration
+
+"""
+Hash of everything a plan depends on.
+"""
+def plan_key(doses, pins):
+    inputs = (plan_version, kinematics.geometry_key(), sorted(doses.items()), tuple(pins),
+              config.stepper_cal_1, config.stepper_cal_2, config.step_mode, config.offset,
+              config.load_angle, config.dispense_angle, config.vibrate_time,
+              config.motion_profile, config.start_vel, config.max_vel, config.max_acc,
+              config.max_jerk, workspace.workspace_key(), waveform.pulse_width)
+    return hashlib.sha1(repr(inputs).encode()).hexdigest()[:16]
+
+"""
+Compile the plan of a cycle feeding the jars in doses, given as
+{(x, y): day}, as a dict of arrays. Moves run from home through the
+jars to feed and any jars passed to keep clear of the walls, and each
+distinct move is compiled once. The move time of the route through
+every jar is kept to tell how much skipping jars saves.
+"""
+def compile_plan(doses, pins):
+    jars = route.plan(sorted(doses))
+    # With nothing to feed the arm stays home, without an exit route
+    path = route.expand(jars) if jars else []
+    targets = [route.jar_steps(jar) for jar in [None] + [jar for jar, feed in path]]
+    steps = []
+    for a, b in zip(targets, targets[1:]):
+        move = (a[0] - b[0], a[1] - b[1])
+        if move not in steps:
+            steps.append(move)
+
+    compiled = [move_pulses(*move, pins) for move in steps]
+    trains = [train for train, duration in compiled]
+    durations = [duration for train, duration in compiled]
+    pulses = np.array([p for train in trains for p in train], dtype=np.uint32).reshape(-1, 3)
+    days = sorted(config.load_angle)
+    return {
+        'jars': np.array(jars, dtype=np.int64).reshape(-1, 2),
+        'path': np.array([jar + (feed,) for jar, feed in path], dtype=np.int64).reshape(-1, 3),
+        'doses': np.array([doses[jar] for jar in jars], dtype=np.int64),
+        'servo_days': np.array(days, dtype=np.int64),
+        'servo': np.array([[config.load_angle[day] + config.offset,
+                            config.dispense_angle[day] + config.offset] for day in days]),
+        'vibrate': np.array(config.vibrate_time),
+        'move_time': np.array([route.route_time(route.plan()),
+                               route.route_time(jars) if jars else 0]),
+        'steps': np.array(steps, dtype=np.int64),
+        'durations': np.array(durations, dtype=np.int64),
+        'bounds': np.cumsum([0] + [len(train) for train in trains]),
+        'pulses': pulses,
+        }
+
+"""
+Compiled plan of a feeding cycle.
+"""
+class Plan:
+    def __init__(self, data):
+        self.data = data
+        self.jars = [tuple(jar) for jar in data['jars'].tolist()]
+        self.doses = dict(zip(self.jars, data['doses'].tolist()))
+        # Every jar gone to in order, and whether it is fed or only passed
+        self.path = [((x, y), bool(feed)) for x, y, feed in data['path'].tolist()]
+        # (load angle, release angle) of each day setting
+        self.servo = dict(zip(data['servo_days'].tolist(), map(tuple, data['servo'].tolist())))
+        self.vibrate = float(data['vibrate'])
+        # Predicted move time in seconds through every jar and through
+        # the jars fed
+        self.full_move_time, self.move_time = data['move_time'].tolist()
+        self.moves = {tuple(move): i for i, move in enumerate(data['steps'].tolist())}
+
+    """
+    Pulse train and duration in us of a move, or None if the plan does
+    not include it.
+    """
+    def pulses(self, step_count_1, step_count_2):
+        i = self.moves.get((step_count_1, step_count_2))
+        if i is None:
+            return None
+        start, end = self.data['bounds'][i:i+2]
+        return list(map(tuple, self.data['pulses'][start:end].tolist())), int(self.data['durations'][i])
+
+"""
+Plan of the cycle feeding the jars in doses, loaded from disk or
+compiled and saved if the doses or configuration have changed since it
+was last compiled.
+"""
+def load(doses, pins):
+    path = os.path.join(plan_dir, 'plan-' + plan_key(doses, pins) + '.npz')
+    try:
+        with np.load(path) as data:
+            return Plan({name: data[name] for name in data.files})
+    except (OSError, ValueError):
+        pass
+
+    data = compile_plan(doses, pins)
+    os.makedirs(plan_dir, exist_ok=True)
+    # Write to a temporary file first so a partial plan is never loaded
+    np.savez_compressed(path + '.tmp.npz', **data)
+    os.replace(path + '.tmp.npz', path)
+    return Plan(data)
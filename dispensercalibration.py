@@ -2,12 +2,13 @@
 
 import math
 import datetime
-import pigpio
 import sys
 import os
 import threading
-from time import sleep
 from subprocess import call
+import servo
+from config import load_dwell, dispense_dwell
+from hardware import pigpio, sleep
 
 if len(sys.argv) < 1:
     print("Provide 1 argument:\nOffset for measure disk in degrees")
@@ -35,6 +36,14 @@ pi.set_mode(servo_pin, pigpio.OUTPUT)
 pi.set_PWM_frequency(servo_pin, 50)
 pi.set_mode(stop_pin, pigpio.INPUT)
 pi.set_pull_up_down(stop_pin, pigpio.PUD_UP)
+pi.set_glitch_filter(stop_pin, 5000)
+
+# Set by the stop button, and checked before every servo step
+stopping = threading.Event()
+
+# Raised to end the calibration once the stop button has been pressed
+class Stopped(Exception):
+    pass
 
 # Loading and dispensing angles for measure servo (degrees)
 load_angle = {
@@ -53,30 +62,31 @@ dispense_angle = {
     }
 
 def set_servo_angle(angle):
-    servo_wait = 70 / 1000
-    pw = angle * 2000/180 + 500
-    pi.set_servo_pulsewidth(servo_pin, pw)
-    sleep(servo_wait)
+    for pw, wait in servo.move(angle):
+        if stopping.is_set():
+            raise Stopped
+        pi.set_servo_pulsewidth(servo_pin, pw)
+        sleep(wait)
     
 def dispense(i):
     # Load
     set_servo_angle(load_angle[i] + offset)
-    sleep(1)
+    sleep(load_dwell)
 
     # Dispense
     set_servo_angle(dispense_angle[i] + offset)
-    sleep(1)
+    sleep(dispense_dwell)
 
+# Runs on the pigpio thread, so it only stops the servo and leaves the
+# shutdown to the main thread
 def stop_callback(gpio, level, tick):
-    for i in range(20):
-        sleep(0.1)
-        if pi.read(27): return
-            
-    shutdown("STOP BUTTON PRESSED")
+    stopping.set()
+    pi.set_servo_pulsewidth(servo_pin, 0)
 
 def shutdown(result):    
     # Release motor
     pi.set_servo_pulsewidth(servo_pin, 0)
+    servo.release()
     
     print("Shutdown complete.")
     sleep(2)
@@ -95,9 +105,13 @@ try:
     for d in range(1,6):
         dispense(d)
 
-    # Execute process cleanup and pass result as argument
-    shutdown("SUCCESS")
-    
+    result = "SUCCESS"
+
+except Stopped:
+    result = "STOP BUTTON PRESSED"
 except:
-    shutdown(str(sys.exc_info()))
+    result = str(sys.exc_info())
+
+# Execute process cleanup and pass result as argument
+shutdown(result)
 
@@ -0,0 +1,40 @@
+import json
+from config import *
+
+# Per-cart dose map, giving the feeding day setting (1-5) of each jar
+# that is not fed the day's usual dose, or null for a jar to skip.
+# Jars are keyed "x,y", e.g. {"0,0": null, "4,2": 3}. Jars not in the
+# map get the day's dose. Without a map every jar is fed.
+dose_path = '/home/pi/cvt60_doses.json'
+
+"""
+The dose map as {(x, y): day or None}, empty if there is none.
+Raises ValueError if it names a jar or day that does not exist.
+"""
+def load():
+    try:
+        with open(dose_path) as file:
+            entries = json.load(file)
+    except FileNotFoundError:
+        return {}
+
+    dose_map = {}
+    for jar, day in entries.items():
+        x, y = (int(n) for n in jar.split(','))
+        if not (0 <= x < jar_cols and 0 <= y < jar_rows):
+            raise ValueError("Dose map jar out of range: " + jar)
+        # JSON true and 3.0 compare equal to day settings, so only ints count
+        if day is not None and (type(day) is not int or day not in load_angle):
+            raise ValueError("Dose map day setting invalid for jar %s: %s" % (jar, json.dumps(day)))
+        dose_map[x, y] = day
+    return dose_map
+
+"""
+Feeding day setting of every jar to feed on a day, as {(x, y): day}.
+"""
+def doses(day, dose_map=None):
+    if dose_map is None:
+        dose_map = load()
+    jars = {(x, y): day for x in range(jar_cols) for y in range(jar_rows)}
+    jars.update(dose_map)
+    return {jar: jar_day for jar, jar_day in jars.items() if jar_day is not None}
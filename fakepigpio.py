@@ -0,0 +1,127 @@
+import hardware
+
+# Recording stand-in for a pigpio connection, for checking the pulse
+# trains the motion code generates without a board or a simulated arm.
+# Waves finish as soon as they are sent. Everything sent is expanded
+# into the pulses pigpio would play, and calls pigpio would reject
+# raise error.
+
+# pigpio limits
+max_wave_pulses = 12000
+max_chain_bytes = 600
+max_loop_count = 65535
+
+class error(Exception):
+    pass
+
+class pi:
+    def __init__(self):
+        self.calls = []         # (name, arguments) of every call
+        self.waves = {}
+        self.pending = []
+        self.played = []        # (on mask, off mask, delay) of every pulse played
+        self.sends = []         # ('chain', data) or ('wave', mode) of every send
+
+    def __getattr__(self, name):
+        # Pin setup and other calls that do not touch waves are recorded only
+        def call(*args):
+            self.calls.append((name, args))
+            return 0
+        return call
+
+    def get_current_tick(self):
+        return 0
+
+    def wave_clear(self):
+        self.waves.clear()
+        self.pending.clear()
+
+    def wave_add_generic(self, pulses):
+        self.calls.append(('wave_add_generic', (len(pulses),)))
+        self.pending.extend((p.gpio_on, p.gpio_off, p.delay) for p in pulses)
+        if len(self.pending) > max_wave_pulses:
+            raise error("Too many pulses in one wave")
+        return len(self.pending)
+
+    def wave_create(self):
+        if not self.pending:
+            raise error("Empty wave")
+        wave_id = 0
+        while wave_id in self.waves:
+            wave_id += 1
+        self.waves[wave_id] = list(self.pending)
+        self.pending.clear()
+        self.calls.append(('wave_create', (wave_id,)))
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        if wave_id not in self.waves:
+            raise error("No wave %d" % wave_id)
+        del self.waves[wave_id]
+
+    def wave_send_using_mode(self, wave_id, mode):
+        if wave_id not in self.waves:
+            raise error("No wave %d" % wave_id)
+        self.sends.append(('wave', mode))
+        self.played += self.waves[wave_id]
+        return len(self.waves[wave_id])
+
+    def wave_chain(self, data):
+        if len(data) > max_chain_bytes:
+            raise error("Chain too long")
+        self.sends.append(('chain', list(data)))
+        for wave_id in expand_chain(data):
+            if wave_id not in self.waves:
+                raise error("No wave %d" % wave_id)
+            self.played += self.waves[wave_id]
+
+    def wave_tx_busy(self):
+        return 0
+
+    def wave_tx_at(self):
+        return hardware.pigpio.NO_TX_WAVE
+
+    def wave_tx_stop(self):
+        self.calls.append(('wave_tx_stop', ()))
+
+    """
+    Times in us of the rising and falling edges of each pin in the
+    pulses played, as {pin: (rising, falling)}.
+    """
+    def edges(self, pins):
+        edges = {pin: ([], []) for pin in pins}
+        t = 0
+        for on, off, delay in self.played:
+            for pin in pins:
+                if on & (1 << pin):
+                    edges[pin][0].append(t)
+                if off & (1 << pin):
+                    edges[pin][1].append(t)
+            t += delay
+        return edges
+
+"""
+Expand a wave chain into the sequence of wave ids it sends, checking
+loops are well formed. Supports loops (255 0 ... 255 1 x y).
+"""
+def expand_chain(data):
+    out, stack, i = [], [], 0
+    while i < len(data):
+        if data[i] == 255 and data[i+1] == 0:
+            stack.append(len(out))
+            i += 2
+        elif data[i] == 255 and data[i+1] == 1:
+            if not stack:
+                raise error("Loop end without loop start")
+            count = data[i+2] + 256*data[i+3]
+            if not 0 < count <= max_loop_count:
+                raise error("Loop count out of range")
+            start = stack.pop()
+            out += out[start:] * (count - 1)
+            i += 4
+        else:
+            out.append(data[i])
+            i += 1
+    if stack:
+        raise error("Loop start without loop end")
+    return out
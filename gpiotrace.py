@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import queue
+import datetime
+import threading
+import numpy as np
+from array import array
+import timing
+from hardware import pigpio
+
+# Optional binary trace of every GPIO level change in a run, for post
+# mortems of failed runs. pigpio callbacks on the traced pins, outputs
+# included, record each edge as a fixed-width (tick, pin, value) record
+# into an array buffer. Full buffers are handed to a writer thread in
+# blocks, so the callbacks never wait on the disk. Servo pulse width
+# changes are recorded the same way, with SERVO added to the pin.
+#
+#   gpiotrace.py <trace>            print a summary of a trace
+#   gpiotrace.py replay <trace>     replay a trace into the simulator
+
+# Directory traces are written to, next to the timing traces
+trace_dir = timing.trace_dir
+
+# Start of every trace file, followed by the records
+magic = b'CVT60GPIO1\0\0\0\0\0\0'
+
+# Layout of one record: tick in us, pin and level or pulse width
+record_dtype = np.dtype([('tick', '<u4'), ('pin', '<u2'), ('value', '<u2')])
+
+# Added to the pin of records holding a servo pulse width
+SERVO = 1 << 8
+
+# Records per block written to disk
+block_records = 1 << 16
+
+# Records of the current block. Each record is two words: the tick,
+# then the pin in the low half and the value in the high half.
+buffer = array('I')
+lock = threading.Lock()
+blocks = queue.SimpleQueue()
+writer = None
+path = None
+callbacks = []
+
+"""
+Start tracing the given pins to a new trace file. Returns its path.
+"""
+def start(pi, pins):
+    global writer, path
+    stop()
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, datetime.datetime.now().strftime('run-%Y%m%d-%H%M%S.gpio'))
+    file = open(path, 'wb')
+    file.write(magic)
+    writer = threading.Thread(target=write, args=(file,), name='gpiotrace', daemon=True)
+    writer.start()
+    for pin in pins:
+        record(pin, pi.read(pin), pi.get_current_tick())
+        callbacks.append(pi.callback(pin, pigpio.EITHER_EDGE, record))
+    return path
+
+"""
+Record an event. Used as the pigpio callback of every traced pin.
+"""
+def record(gpio, level, tick):
+    global buffer
+    with lock:
+        buffer.append(tick)
+        buffer.append(gpio | level << 16)
+        if len(buffer) >= 2*block_records:
+            blocks.put(buffer)
+            buffer = array('I')
+
+def servo(pi, gpio, pulsewidth):
+    if callbacks:
+        record(gpio + SERVO, int(pulsewidth), pi.get_current_tick())
+
+def write(file):
+    with file:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            # Records are stored little endian whatever the platform
+            if sys.byteorder != 'little':
+                block.byteswap()
+            block.tofile(file)
+
+"""
+Stop tracing and write out what is left. Returns the path of the
+trace, or None if none was running.
+"""
+def stop():
+    global buffer, writer
+    for cb in callbacks:
+        cb.cancel()
+    callbacks.clear()
+    if writer is None:
+        return None
+    with lock:
+        blocks.put(buffer)
+        buffer = array('I')
+    blocks.put(None)
+    writer.join()
+    writer = None
+    return path
+
+def active():
+    return bool(callbacks)
+
+"""
+Memory-mapped records of a trace, read from disk only as they are used.
+"""
+def load(trace):
+    with open(trace, 'rb') as file:
+        if file.read(len(magic)) != magic:
+            raise ValueError("Not a GPIO trace: " + trace)
+    if os.path.getsize(trace) == len(magic):
+        return np.zeros(0, dtype=record_dtype)
+    return np.memmap(trace, dtype=record_dtype, mode='r', offset=len(magic))
+
+"""
+Time of each record in seconds from the first. Ticks wrap every 72
+minutes, so the time is summed from the tick differences taken modulo
+2**32. The differences are signed, so a record arriving slightly out of
+tick order is not taken for a wrap.
+"""
+def seconds(records):
+    if not len(records):
+        return np.zeros(0)
+    steps = (np.diff(records['tick'].astype(np.int64)) + (1 << 31)) % (1 << 32) - (1 << 31)
+    return np.concatenate([[0], np.cumsum(steps)]) / 1000000
+
+"""
+Duration of a trace and the number of level changes and final value
+of each pin.
+"""
+def summary(records):
+    pins = {}
+    for pin in np.unique(records['pin']).tolist():
+        values = records['value'][records['pin'] == pin]
+        pins[pin] = dict(events=len(values), last=int(values[-1]))
+    times = seconds(records)
+    return dict(events=len(records), duration=float(times.max()) if len(times) else 0, pins=pins)
+
+"""
+Replay a trace into the simulator: output levels and servo pulse widths
+are set at their recorded times, so the simulated arm moves as the real
+one was driven, starting from the simulator's start_angle. Inputs are
+left to the simulator, and the recorded limit switch levels are
+compared with the simulated ones. Returns the final arm angles, the
+steps lost by the stall model and the limit switch records that
+disagree, as (seconds, pin, recorded level).
+"""
+def replay(records):
+    import simpigpio
+    simpigpio.reset()
+    inputs = set(simpigpio.limit_pins.values()) | {simpigpio.stop_pin}
+    mismatches = []
+    times = seconds(records)
+    for time, pin, value in zip(times.tolist(), records['pin'].tolist(),
+                                records['value'].tolist()):
+        simpigpio.sleep(time - simpigpio.now)
+        if pin >= SERVO:
+            simpigpio.servo[pin - SERVO] = value
+        elif pin in inputs:
+            if pin != simpigpio.stop_pin and simpigpio.levels[pin] != value:
+                mismatches.append((round(time, 6), pin, value))
+        else:
+            simpigpio.set_level(pin, value)
+    return dict(angles=simpigpio.angles(), lost_steps=dict(simpigpio.lost_steps),
+                mismatches=mismatches)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'replay':
+        print(replay(load(sys.argv[2])))
+    elif len(sys.argv) == 2:
+        print(summary(load(sys.argv[1])))
+    else:
+        print("Usage: gpiotrace.py [replay] <trace>")
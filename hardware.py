@@ -0,0 +1,32 @@
+import os
+import asyncio
+from time import sleep, monotonic
+
+# Set CVT60_SIM=1 to run against the simulated board in simpigpio
+# instead of the pigpio daemon. sleep() and monotonic() then use the
+# simulated virtual clock.
+simulated = bool(os.environ.get('CVT60_SIM'))
+
+if simulated:
+    import simpigpio as pigpio
+    sleep, monotonic = pigpio.sleep, pigpio.monotonic
+else:
+    import pigpio
+
+def new_event_loop():
+    if simulated:
+        return pigpio.EventLoop()
+    return asyncio.new_event_loop()
+
+"""
+Run a coroutine to completion on a new event loop, which runs on the
+virtual clock when simulated.
+"""
+def run(coroutine):
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,71 @@
+import asyncio
+from http import HTTPStatus
+
+# Minimal HTTP/1.1 server and client on asyncio, for small JSON and text
+# endpoints served alongside other work on the same event loop. Every
+# request is answered and its connection closed.
+
+# Largest request body accepted in bytes
+max_body = 1 << 20
+
+# Time allowed to read a request in seconds
+read_timeout = 10
+
+# Connections that may wait to be accepted, enough for a burst from a fleet
+backlog = 1024
+
+"""
+Start serving requests on host and port. handler is called with the
+method, path and body of each request and returns the status, content
+type and body of the response. Returns the asyncio server.
+"""
+async def serve(handler, host, port):
+    return await asyncio.start_server(lambda reader, writer: respond(handler, reader, writer),
+                                      host, port, backlog=backlog)
+
+async def respond(handler, reader, writer):
+    try:
+        try:
+            method, path, body = await asyncio.wait_for(read_request(reader), read_timeout)
+            status, content_type, content = handler(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            status, content_type, content = 400, 'text/plain', b'Bad request\n'
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+                     b'Connection: close\r\n\r\n' % (status, HTTPStatus(status).phrase.encode(),
+                                                     content_type.encode(), len(content)) + content)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def read_request(reader):
+    method, path, version = (await reader.readline()).decode('latin-1').split()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ('\r\n', '\n', ''):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > max_body:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method, path, body
+
+"""
+Make a request to a server. Returns the status and body of the response.
+"""
+async def request(host, port, method, path, body=b'', content_type='application/json'):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(b'%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+                     b'Connection: close\r\n\r\n' % (method.encode(), path.encode(), host.encode(),
+                                                     content_type.encode(), len(body)) + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), content
@@ -0,0 +1,98 @@
+import asyncio
+import datetime
+import sys
+import threading
+import cart
+import hardware
+from hardware import monotonic
+
+# Runs feeding cycles inside a long-lived process such as cvt60daemon.
+# The cart engine stays loaded and cycles run on one event loop in a
+# background thread, so a button press starts moving the arm at once.
+# Only one cycle runs at a time.
+
+# Event loop cycles run on, started by start()
+loop = None
+
+# Held while a job is being submitted, so two presses cannot both start one
+lock = threading.Lock()
+
+# Status of the current or last job
+job = None
+
+# Number of jobs submitted since start()
+job_count = 0
+
+# Future of the current or last job
+future = None
+
+# Functions called with a copy of the status of every job once it is
+# done, such as metrics.observe
+observers = []
+
+"""
+Start the event loop that jobs run on. Cycles run from then on end
+without the pauses a cart process of its own needs.
+"""
+def start():
+    global loop
+    cart.standalone = False
+    loop = hardware.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='jobs', daemon=True).start()
+
+"""
+Start a feeding cycle unless one is already running. requested is the
+hardware.monotonic() time the cycle was asked for, used to measure the
+time to the first step. Returns True if the cycle was started.
+"""
+def submit(requested=None):
+    global job, job_count, future
+    with lock:
+        if running():
+            return False
+        job_count += 1
+        job = dict(id=job_count, status='queued', result=None,
+                   date=str(datetime.datetime.now()), first_step=None, duration=None)
+        future = asyncio.run_coroutine_threadsafe(
+            run(job, monotonic() if requested is None else requested), loop)
+        return True
+
+async def run(job, requested):
+    job['status'] = 'running'
+    try:
+        job['result'] = await cart.main(job['id'])
+    except Exception:
+        job['result'] = str(sys.exc_info())
+    finally:
+        if cart.first_step is not None:
+            job['first_step'] = round(cart.first_step - requested, 6)
+        job['duration'] = round(monotonic() - requested, 6)
+        job['status'] = 'done'
+        for observer in observers:
+            try:
+                observer(dict(job))
+            except Exception as e:
+                print("Job observer failed: " + str(e))
+
+def running():
+    return job is not None and job['status'] != 'done'
+
+"""
+Stop the running cycle as if the stop button was pressed. The cycle
+still shuts down, disabling the motors.
+"""
+def cancel():
+    if running():
+        loop.call_soon_threadsafe(cart.request_stop)
+
+"""
+Wait up to timeout seconds for the current job to finish.
+Returns True if no job is left running.
+"""
+def wait(timeout=None):
+    if future is not None:
+        try:
+            future.result(timeout)
+        except Exception:
+            pass
+    return not running()
@@ -0,0 +1,128 @@
+import os
+import hashlib
+import numpy as np
+from functools import lru_cache
+from config import *
+
+# Directory holding precomputed jar tables
+table_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# Closest the elbow may come to fully straight or fully folded (degrees)
+singular_margin = 5
+
+"""
+Coordinates in mm of the center of jar (x, y) relative to the arm
+shoulder axis. Accepts single jars or arrays of jars.
+"""
+def jar_coords(x, y):
+    # Add radius to get center of jar and subtract arm origin offset
+    x_coord = np.asarray(x)*jar_diam + jar_diam/2 - ori_x
+    y_coord = np.asarray(y)*jar_diam + jar_diam/2 - ori_y
+    return x_coord, y_coord
+
+"""
+Inverse kinematics.
+Angles of both steppers in degrees for arm coordinates in mm. Points on
+the wall side of the shoulder (x > 0) are reached with the elbow on
+one side and all others with the elbow on the other, as the cart has
+always done. Unreachable points give nan.
+"""
+def inverse(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    r2 = x*x + y*y
+    r = np.sqrt(r2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Angle between upper arm and the line from shoulder to point
+        shoulder = np.degrees(np.arccos((r2 + arm_1*arm_1 - arm_2*arm_2) / (2*r*arm_1)))
+        # Angle between upper arm and forearm
+        elbow = np.degrees(np.arccos((arm_1*arm_1 + arm_2*arm_2 - r2) / (2*arm_1*arm_2)))
+    theta = np.degrees(np.arctan2(y, x))
+
+    angle_1 = np.where(x > 0, 180 - theta - shoulder, 180 - theta + shoulder)
+    angle_2 = np.where(x > 0, elbow, 360 - elbow)
+    return angle_1, angle_2
+
+"""
+Forward kinematics.
+Arm coordinates in mm for angles of both steppers in degrees.
+"""
+def forward(angle_1, angle_2):
+    upper = np.radians(180 - np.asarray(angle_1, dtype=float))
+    fore = np.radians(np.asarray(angle_2, dtype=float) - np.asarray(angle_1, dtype=float))
+    x = arm_1*np.cos(upper) + arm_2*np.cos(fore)
+    y = arm_1*np.sin(upper) + arm_2*np.sin(fore)
+    return x, y
+
+"""
+True where arm coordinates in mm can be reached without the elbow
+coming within singular_margin degrees of straight or folded.
+"""
+def reachable(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    angle_2 = inverse(x, y)[1]
+    elbow = np.where(angle_2 > 180, 360 - angle_2, angle_2)
+    return (elbow >= singular_margin) & (elbow <= 180 - singular_margin)
+
+"""
+Absolute stepper positions in steps from home for angles in degrees.
+"""
+def angles_to_steps(angle_1, angle_2):
+    steps_1 = np.rint(stepper_1_deg_to_step*np.asarray(angle_1)).astype(np.int64)
+    steps_2 = np.rint(stepper_2_deg_to_step*np.asarray(angle_2)).astype(np.int64)
+    return steps_1, steps_2
+
+"""
+Hash of everything the jar table depends on.
+"""
+def geometry_key():
+    geometry = (jar_cols, jar_rows, jar_diam, ori_x, ori_y, arm_1, arm_2,
+                stepper_1_deg_to_step, stepper_2_deg_to_step, singular_margin)
+    return hashlib.sha1(repr(geometry).encode()).hexdigest()[:16]
+
+"""
+Compute angles and absolute step targets for every jar on the cart.
+Raises ValueError if any jar is out of reach.
+"""
+def build_jar_table():
+    x, y = np.meshgrid(np.arange(jar_cols), np.arange(jar_rows), indexing='ij')
+    x_coord, y_coord = jar_coords(x, y)
+
+    ok = reachable(x_coord, y_coord)
+    if not ok.all():
+        jars = list(zip(x[~ok].tolist(), y[~ok].tolist()))
+        raise ValueError("Jars out of reach: " + str(jars))
+
+    angle_1, angle_2 = inverse(x_coord, y_coord)
+    steps_1, steps_2 = angles_to_steps(angle_1, angle_2)
+    return {
+        'angles': np.stack((angle_1, angle_2), axis=-1),
+        'steps': np.stack((steps_1, steps_2), axis=-1),
+        }
+
+"""
+Angles and absolute step targets for every jar, indexed [col, row].
+The table is stored on disk under a hash of the arm geometry so it is
+only recomputed when the geometry changes.
+"""
+@lru_cache(maxsize=None)
+def jar_table():
+    path = os.path.join(table_dir, 'jars-' + geometry_key() + '.npz')
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        pass
+
+    table = build_jar_table()
+    os.makedirs(table_dir, exist_ok=True)
+    # Write to a temporary file first so a partial table is never loaded
+    np.savez(path + '.tmp.npz', **table)
+    os.replace(path + '.tmp.npz', path)
+    return table
+
+"""
+Absolute step targets of both steppers for jar (x, y).
+"""
+def jar_steps(x, y):
+    steps = jar_table()['steps'][x, y]
+    return int(steps[0]), int(steps[1])
@@ -1,30 +1,145 @@
+import os
 import sys
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import datetime
+import json
+import threading
+import urllib.request
+import hardware
+import spool
+from config import collector_url
 
-# This script must be passed two arguments: CVT60 unit number and the result of the feeding
-unit = sys.argv[1]
-result = sys.argv[2]
+# Ships results from the local spool to the shared Google Sheets log, or
+# to the fleet telemetry collector if collector_url is set.
+# Run with no arguments to send everything pending and exit, or call
+# start() to keep a shipper running in the background of a process.
+# The old form, logger.py <unit> <result>, first adds the result to
+# the spool.
 
-scope = ['https://spreadsheets.google.com/feeds','https://www.googleapis.com/auth/drive']
-creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-client = gspread.authorize(creds)
+sheet_name = 'CVT60 log'
+credentials = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'credentials.json')
 
-for attempt in range(10):
-    try:
-        sheet = client.open('CVT60 log').sheet1
+# Most results sent to the sheet in one append
+batch_size = 50
 
-        date = str(datetime.datetime.now())
+# Column of the sheet holding each row's key, used to skip rows that
+# were already logged
+key_column = 5
 
-        row = [date[:10], date[11:19], unit, result]
-        # Insert report on row 6
-        # If more than four CVT60 units are active, this will need to be changed
-        index = 6
-        sheet.insert_row(row, index)
-        break
+# Wait after a failure in seconds, doubled after each further failure
+backoff_start = 5
+backoff_max = 640
 
-    except Exception as e:
-        print('Cannot connect to GoogleDrive')
-        print(e)
+# Time between checks of the spool when nothing wakes the shipper (seconds)
+poll_wait = 600
 
+# Set to wake a background shipper when a result has been spooled
+wake = threading.Event()
+
+# Background shipper thread, started by start()
+thread = None
+
+# Results shipped by this process, and failures in a row since the last
+# successful pass
+shipped = 0
+failures = 0
+
+"""
+Authorize with Google and open the log sheet.
+"""
+def open_sheet():
+    if hardware.simulated:
+        import simsheets
+        client = simsheets.authorize()
+    else:
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+        scope = ['https://spreadsheets.google.com/feeds','https://www.googleapis.com/auth/drive']
+        creds = ServiceAccountCredentials.from_json_keyfile_name(credentials, scope)
+        client = gspread.authorize(creds)
+    return client.open(sheet_name).sheet1
+
+"""
+Send one batch of pending results to a sheet with a single append, or
+to the collector in a single post. Rows whose key is already on the
+sheet are not sent again, and the collector drops keys it has seen, so
+a batch that was sent but not marked as shipped is never duplicated.
+Returns the number of results taken from the spool.
+"""
+def ship(sheet, limit=batch_size):
+    global shipped
+    rows = spool.pending(limit)
+    if not rows:
+        return 0
+    if collector_url:
+        post([dict(key=key, date=date, time=time, unit=unit, result=result, data=data)
+              for key, date, time, unit, result, data in rows])
+    else:
+        logged = set(sheet.col_values(key_column))
+        new = [[date, time, unit, result, key] for key, date, time, unit, result, data in rows
+               if key not in logged]
+        if new:
+            sheet.append_rows(new)
+    spool.mark_shipped([row[0] for row in rows])
+    shipped += len(rows)
+    return len(rows)
+
+def post(results):
+    request = urllib.request.Request(collector_url + '/results', json.dumps(results).encode(),
+                                     {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+
+"""
+Ship pending results until the spool is empty, retrying failures with
+exponential backoff. With once set, returns True when the spool has
+been emptied, or False once the backoff has reached backoff_max.
+Otherwise it then waits to be woken and never returns.
+"""
+def run(once=False, sleep=hardware.sleep):
+    global failures
+    sheet = None
+    backoff = backoff_start
+    while True:
+        try:
+            if sheet is None and not collector_url:
+                sheet = open_sheet()
+            while ship(sheet):
+                pass
+            backoff = backoff_start
+            failures = 0
+            if once:
+                return True
+            wake.wait(poll_wait)
+            wake.clear()
+        except Exception as e:
+            print('Cannot connect to GoogleDrive')
+            print(e)
+            sheet = None
+            failures += 1
+            if once and backoff >= backoff_max:
+                return False
+            sleep(backoff)
+            backoff = min(2*backoff, backoff_max)
+
+"""
+Keep a shipper running in a background thread.
+"""
+def start():
+    global thread
+    thread = threading.Thread(target=run, name='logger', daemon=True)
+    thread.start()
+
+def running():
+    return thread is not None and thread.is_alive()
+
+"""
+Wake the background shipper to send newly spooled results.
+"""
+def notify():
+    wake.set()
+
+
+if __name__ == '__main__':
+    # Optional arguments: CVT60 unit number and the result of the feeding
+    if len(sys.argv) > 2:
+        spool.add(sys.argv[1], sys.argv[2])
+    run(once=True)
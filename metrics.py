@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+
+import sys
+import asyncio
+import threading
+from bisect import bisect_left
+from time import monotonic
+import connectivity
+import httpserve
+import jobs
+import logger
+import spool
+import timing
+
+# Prometheus-style metrics of a daemon running cycles, served as text at
+# /metrics. The server runs on its own event loop in its own thread, so
+# a scrape never holds up the led loop or a running cycle. Each cycle is
+# recorded by observe() as it finishes, as an observer of jobs.
+#
+#   metrics.py [host [port]]    scrape a daemon and print its metrics
+
+# Address served on. Use '0.0.0.0' to be scraped over the network.
+host = '127.0.0.1'
+port = 9060
+
+# Upper bounds in seconds of the histogram buckets
+cycle_buckets = [60, 120, 180, 240, 300, 360, 480, 600]
+homing_buckets = [1, 2, 3, 4, 5, 7.5, 10, 15, 20, 30]
+stop_buckets = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5]
+first_step_buckets = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+
+# Held while metrics are recorded or rendered
+lock = threading.Lock()
+
+# Event loop the server runs on, started by start()
+loop = None
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    """
+    Samples of the histogram, with cumulative bucket counts.
+    """
+    def samples(self, name, **labels):
+        total = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            total += count
+            yield sample(name + '_bucket', total, le=bound, **labels)
+        yield sample(name + '_sum', self.sum, **labels)
+        yield sample(name + '_count', total, **labels)
+
+# Label of each cycle result. Any other result is an error.
+result_labels = {
+    "SUCCESS": 'success',
+    "STOP BUTTON PRESSED": 'stop',
+    "CYCLE CANCELLED": 'cancelled',
+    }
+
+# Cycles run by result label, and total time in each phase of them (seconds)
+cycles = {label: 0 for label in ['success', 'stop', 'cancelled', 'homing_failed', 'error']}
+phase_seconds = {}
+
+cycle_duration = Histogram(cycle_buckets)
+homing_duration = {'home': Histogram(homing_buckets), 'verify': Histogram(homing_buckets)}
+stop_latency = Histogram(stop_buckets)
+first_step = Histogram(first_step_buckets)
+
+"""
+Label of a cycle result, from a fixed set so the label values stay few.
+"""
+def result_label(result):
+    if result in result_labels:
+        return result_labels[result]
+    if str(result).endswith("HOMING FAILED"):
+        return 'homing_failed'
+    return 'error'
+
+"""
+Record a finished job (see jobs). Its phases are taken from the timing
+records of its run, which carry the job id. A job that failed before
+its run started has none.
+"""
+def observe(job):
+    records = timing.records
+    run = records[0] if records and records[0].get('job') == job['id'] else None
+    with lock:
+        cycles[result_label(job['result'])] += 1
+        cycle_duration.observe(run['duration'] if run else job['duration'])
+        if job['first_step'] is not None:
+            first_step.observe(job['first_step'])
+        if run is None:
+            return
+        for record in records[1:]:
+            seconds = record['end'] - record['start']
+            phase_seconds[record['phase']] = phase_seconds.get(record['phase'], 0) + seconds
+            if record['phase'] in homing_duration:
+                homing_duration[record['phase']].observe(seconds)
+        if run.get('stop_latency_ms') is not None:
+            stop_latency.observe(run['stop_latency_ms'] / 1000)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def sample(name, value, **labels):
+    if labels:
+        name += '{%s}' % ','.join('%s="%s"' % (label, escape(v)) for label, v in labels.items())
+    return '%s %s' % (name, value)
+
+"""
+Header lines of a metric.
+"""
+def describe(name, kind, text):
+    return ['# HELP %s %s' % (name, text), '# TYPE %s %s' % (name, kind)]
+
+"""
+All metrics in the Prometheus text format.
+"""
+def render():
+    lines = []
+    with lock:
+        lines += describe('cvt60_cycles_total', 'counter', "Feeding cycles run, by result.")
+        lines += [sample('cvt60_cycles_total', count, result=result)
+                  for result, count in sorted(cycles.items())]
+        lines += describe('cvt60_cycle_running', 'gauge', "1 while a cycle is running.")
+        lines.append(sample('cvt60_cycle_running', int(jobs.running())))
+        lines += describe('cvt60_cycle_duration_seconds', 'histogram', "Duration of cycles.")
+        lines += cycle_duration.samples('cvt60_cycle_duration_seconds')
+        lines += describe('cvt60_homing_duration_seconds', 'histogram',
+                          "Duration of full homing and of verifying a saved position.")
+        for phase, histogram in homing_duration.items():
+            lines += histogram.samples('cvt60_homing_duration_seconds', phase=phase)
+        lines += describe('cvt60_phase_seconds_total', 'counter',
+                          "Time spent in each phase of cycles.")
+        lines += [sample('cvt60_phase_seconds_total', round(seconds, 6), phase=phase)
+                  for phase, seconds in sorted(phase_seconds.items())]
+        lines += describe('cvt60_stop_latency_seconds', 'histogram',
+                          "Time from a stop request to the motors being stopped.")
+        lines += stop_latency.samples('cvt60_stop_latency_seconds')
+        lines += describe('cvt60_first_step_seconds', 'histogram',
+                          "Time from a cycle being asked for to its first step.")
+        lines += first_step.samples('cvt60_first_step_seconds')
+
+    lines += describe('cvt60_spool_backlog', 'gauge', "Results waiting to be logged.")
+    try:
+        lines.append(sample('cvt60_spool_backlog', spool.backlog()))
+    except Exception:
+        pass
+    lines += describe('cvt60_results_shipped_total', 'counter', "Results logged by the shipper.")
+    lines.append(sample('cvt60_results_shipped_total', logger.shipped))
+    lines += describe('cvt60_shipper_failures', 'gauge', "Failed shipping attempts in a row.")
+    lines.append(sample('cvt60_shipper_failures', logger.failures))
+    lines += describe('cvt60_shipper_running', 'gauge', "1 while the shipper is running.")
+    lines.append(sample('cvt60_shipper_running', int(logger.running())))
+
+    lines += describe('cvt60_online', 'gauge',
+                      "1 if the last connectivity probe succeeded, absent before the first.")
+    if connectivity.online is not None:
+        lines.append(sample('cvt60_online', int(connectivity.online)))
+        lines += describe('cvt60_connectivity_probe_age_seconds', 'gauge',
+                          "Time since the last connectivity probe.")
+        lines.append(sample('cvt60_connectivity_probe_age_seconds',
+                            round(monotonic() - connectivity.checked, 3)))
+        lines += describe('cvt60_connectivity_latency_seconds', 'gauge',
+                          "Latency of the last connectivity probe.")
+        lines.append(sample('cvt60_connectivity_latency_seconds', round(connectivity.latency, 6)))
+    lines += describe('cvt60_connectivity_failures', 'gauge', "Failed probes in a row.")
+    lines.append(sample('cvt60_connectivity_failures', connectivity.failures))
+    return '\n'.join(lines) + '\n'
+
+def handle(method, path, body):
+    if method == 'GET' and path == '/metrics':
+        return 200, 'text/plain; version=0.0.4', render().encode()
+    return 404, 'text/plain', b'Not found\n'
+
+"""
+Record finished jobs and serve metrics from a background thread.
+Returns the asyncio server. Raises OSError if the port cannot be bound.
+"""
+def start():
+    global loop
+    if observe not in jobs.observers:
+        jobs.observers.append(observe)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='metrics', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(httpserve.serve(handle, host, port), loop).result()
+
+"""
+Scrape a metrics server. Returns {sample: value}, where a sample is the
+metric name with any labels as served.
+"""
+def scrape(scrape_host=None, scrape_port=None):
+    status, body = asyncio.run(httpserve.request(scrape_host or host, scrape_port or port,
+                                                 'GET', '/metrics'))
+    if status != 200:
+        raise ValueError("Metrics request failed with status %d" % status)
+    return parse(body.decode())
+
+def parse(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            samples[name] = float(value)
+    return samples
+
+
+if __name__ == '__main__':
+    scrape_host = sys.argv[1] if len(sys.argv) > 1 else None
+    scrape_port = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    for name, value in scrape(scrape_host, scrape_port).items():
+        print(name, value)
@@ -0,0 +1,52 @@
+import numpy as np
+
+"""
+Step times in microseconds for a table of inter-step delays in seconds.
+The first step is taken at time 0 and each delay follows its step.
+Returns the step times and the total duration of the move.
+"""
+def step_times(delays):
+    delays = np.rint(np.asarray(delays, dtype=float) * 1000000).astype(np.int64)
+    times = np.concatenate(([0], np.cumsum(delays)))
+    return times[:-1], int(times[-1])
+
+"""
+Coordinated two-axis move.
+Takes the delay table each axis would use on its own. The axis with
+more steps leads and the other axis follows, with its steps placed at
+the same fraction of the lead axis' progress. Both axes start
+and finish together. The move takes as long as the slower axis needs,
+so if the following axis is the slower one the lead timing is
+stretched to match it.
+Returns the step times in us for axis 1 and axis 2 and the duration.
+"""
+def coordinate(delays_1, delays_2):
+    times_1, duration_1 = step_times(delays_1)
+    times_2, duration_2 = step_times(delays_2)
+    duration = max(duration_1, duration_2)
+
+    if len(times_1) >= len(times_2):
+        lead = stretch(times_1, duration_1, duration)
+        return lead, follow(lead, len(times_2)), duration
+    lead = stretch(times_2, duration_2, duration)
+    return follow(lead, len(times_1)), lead, duration
+
+def stretch(times, duration, new_duration):
+    if duration == new_duration:
+        return times
+    return times * new_duration // duration
+
+"""
+Step times for a following axis of step_count steps.
+Step j of the follower happens at lead progress j*n/step_count, with
+the time interpolated between the lead steps either side, so the
+follower runs the lead's velocity profile scaled down rather than
+jumping between lead steps. Its last step lines up with the last lead
+step.
+"""
+def follow(lead_times, step_count):
+    n = len(lead_times)
+    if not step_count:
+        return lead_times[:0]
+    progress = np.arange(1, step_count+1) * n / step_count - 1
+    return np.rint(np.interp(progress, np.arange(n), lead_times)).astype(np.int64)
@@ -0,0 +1,135 @@
+import numpy as np
+from functools import lru_cache
+import config
+
+# Number of points used to integrate an S-curve ramp
+ramp_points = 2048
+
+"""
+Inter-step delays in seconds for a move of step_count steps on an axis
+(1 or 2), using the velocity profile and limits in config.
+"""
+def delays(step_count, axis):
+    return delay_table(abs(step_count), config.motion_profile,
+                       config.start_vel[axis], config.max_vel[axis],
+                       config.max_acc[axis], config.max_jerk[axis])
+
+"""
+Time in seconds for a move of step_count steps on an axis.
+"""
+def move_time(step_count, axis):
+    n = abs(step_count)
+    if config.motion_profile != 'trapezoid':
+        return float(delays(n, axis).sum())
+
+    # A trapezoid move is its acceleration ramp over the first half of
+    # the steps and the same ramp reversed over the second half
+    ramp = ramp_times(config.start_vel[axis], config.max_vel[axis],
+                      config.max_acc[axis], 1 << ((n + 1)//2).bit_length())
+    return float(ramp[(n + 1)//2] + ramp[n//2])
+
+"""
+Delays in seconds for driving an axis at a steady speed of vel steps
+per second, accelerating up to it from the start speed. There is no
+deceleration ramp, as seeking moves end wherever a limit switch closes.
+"""
+def seek_delays(step_count, axis, vel):
+    return seek_table(abs(step_count), config.start_vel[axis], vel, config.max_acc[axis])
+
+@lru_cache(maxsize=16)
+def seek_table(n, v0, vel, acc):
+    s = np.arange(n) + 0.5
+    v = np.minimum(np.sqrt(v0*v0 + 2*acc*s), vel)
+    table = 1 / v
+    table.flags.writeable = False
+    return table
+
+"""
+Cumulative time of the first k steps of a trapezoid ramp, for k up to
+length - 1.
+"""
+@lru_cache(maxsize=64)
+def ramp_times(v0, vmax, acc, length):
+    s = np.arange(length - 1) + 0.5
+    v = np.minimum(np.sqrt(v0*v0 + 2*acc*s), max(vmax, v0))
+    return np.concatenate(([0], np.cumsum(1 / v)))
+
+"""
+Delay table for a move of n steps.
+The speed of each step is the lowest of the acceleration ramp from the
+start, the deceleration ramp to the end and the maximum speed, so short
+moves accelerate for as long as they can and long moves cruise at the
+maximum speed. Tables are cached by step count and limits, and are
+read only.
+"""
+@lru_cache(maxsize=1024)
+def delay_table(n, shape, v0, vmax, acc, jerk):
+    # Distance travelled in steps at the middle of each step
+    s = np.arange(n) + 0.5
+    vmax = max(vmax, v0)
+
+    if shape == 'trapezoid':
+        ramp = lambda d: np.sqrt(v0*v0 + 2*acc*d)
+    elif shape == 'scurve':
+        ramp = scurve_ramp(n, v0, vmax, acc, jerk)
+    else:
+        raise ValueError("Unknown motion profile: " + str(shape))
+
+    v = np.minimum(np.minimum(ramp(s), ramp(n - s)), vmax)
+    table = 1 / v
+    table.flags.writeable = False
+    return table
+
+"""
+Jerk limited acceleration from v0 to vp.
+Returns the duration of the ramp and arrays of time and velocity.
+"""
+def scurve_velocity(v0, vp, acc, jerk, points=ramp_points):
+    dv = vp - v0
+    if dv <= 0:
+        return 0, np.zeros(1), np.full(1, v0)
+
+    # Time spent raising the acceleration to its peak
+    if dv >= acc*acc/jerk:
+        t1 = acc/jerk
+        duration = dv/acc + t1
+    else:
+        t1 = np.sqrt(dv/jerk)
+        duration = 2*t1
+    peak = jerk*t1
+
+    t = np.linspace(0, duration, points)
+    v = np.where(t < t1, v0 + jerk*t*t/2,
+        np.where(t > duration - t1, vp - jerk*(duration - t)**2/2,
+                 v0 + jerk*t1*t1/2 + peak*(t - t1)))
+    return duration, t, v
+
+"""
+Distance in steps needed for an S-curve ramp from v0 to vp.
+The ramp is symmetric so its mean speed is halfway between the two.
+"""
+def scurve_distance(v0, vp, acc, jerk):
+    duration = scurve_velocity(v0, vp, acc, jerk, points=1)[0]
+    return (v0 + vp)/2 * duration
+
+"""
+Speed against distance for the S-curve ramp of a move of n steps.
+The peak speed is the highest one that can be reached and stopped from
+within the move.
+"""
+def scurve_ramp(n, v0, vmax, acc, jerk):
+    vp = vmax
+    if 2*scurve_distance(v0, vmax, acc, jerk) > n:
+        low, high = v0, vmax
+        for i in range(50):
+            vp = (low + high)/2
+            if 2*scurve_distance(v0, vp, acc, jerk) > n:
+                high = vp
+            else:
+                low = vp
+        vp = low
+
+    duration, t, v = scurve_velocity(v0, vp, acc, jerk)
+    # Integrate speed to get distance travelled at each time
+    d = np.concatenate(([0], np.cumsum((v[1:] + v[:-1])/2 * np.diff(t))))
+    return lambda s: np.interp(s, d, v)
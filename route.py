@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+import numpy as np
+import kinematics
+import motionprofile
+import workspace
+from functools import lru_cache
+from config import *
+
+"""
+Position of both steppers in steps for a jar, or home if jar is None.
+"""
+def jar_steps(jar):
+    if jar is None:
+        return 0, 0
+    return kinematics.jar_steps(*jar)
+
+"""
+Time in seconds to move between two stepper positions.
+Both axes move together, so the move takes as long as the slower axis.
+"""
+def move_time(a, b):
+    return max(motionprofile.move_time(a[0] - b[0], 1),
+               motionprofile.move_time(a[1] - b[1], 2))
+
+"""
+Shortest moves between every pair of workspace nodes that keep clear
+of the walls (see workspace). Moves go direct where that is clear, and
+otherwise by way of other jars. Returns the move times, the next node
+on the way from each node to each other, and for leaving each node for
+home, the node homing starts from and the time to get home.
+"""
+@lru_cache(maxsize=None)
+def detours():
+    table = workspace.safety_table()
+    steps = [jar_steps(workspace.node_jar(n)) for n in range(len(table['homing']))]
+    n = len(steps)
+    direct = np.array([[move_time(a, b) for b in steps] for a in steps])
+
+    # Floyd-Warshall over the clear moves, by way of jars only
+    time = np.where(table['direct'], direct, np.inf)
+    after = np.tile(np.arange(n), (n, 1))
+    for k in range(1, n):
+        via = time[:, k:k+1] + time[k:k+1, :]
+        shorter = via < time - 1e-9
+        time = np.where(shorter, via, time)
+        after = np.where(shorter, after[:, k:k+1], after)
+
+    # Homing starts from a jar, which may be the one being left
+    to_home = np.where(table['homing'], direct[:, 0], np.inf)
+    to_home[0] = np.inf
+    exit_node = np.argmin(time + to_home, axis=1)
+    exit_time = time[np.arange(n), exit_node] + to_home[exit_node]
+    return time, after, exit_node, exit_time
+
+"""
+Time in seconds to move clear of the walls from one jar to another, or
+to or from home if the jar is None.
+"""
+def leg_time(a, b):
+    return float(detours()[0][workspace.node(a), workspace.node(b)])
+
+"""
+Time in seconds to leave a jar for home, by way of a jar homing is
+clear from if needed.
+"""
+def exit_time(jar):
+    return float(detours()[3][workspace.node(jar)])
+
+"""
+Jars to pass between two jars, or home if a jar is None, to keep clear
+of the walls. Empty when the direct move is clear.
+Raises ValueError if there is no clear way.
+"""
+def vias(a, b):
+    time, after = detours()[:2]
+    start, end = workspace.node(a), workspace.node(b)
+    if np.isinf(time[start, end]):
+        raise ValueError("No move clear of the walls from %s to %s" % (a, b))
+    path = []
+    while True:
+        start = int(after[start, end])
+        if start == end:
+            return path
+        path.append(workspace.node_jar(start))
+
+"""
+Jars to pass on leaving a jar for home, ending at one homing is clear
+from. Empty if homing from the jar itself is clear.
+"""
+def exit_vias(jar):
+    exit_node, exit_time = detours()[2:]
+    end = workspace.node_jar(int(exit_node[workspace.node(jar)]))
+    if np.isinf(exit_time[workspace.node(jar)]):
+        raise ValueError("No way home clear of the walls from %s" % (jar,))
+    return [] if end == jar else vias(jar, end) + [end]
+
+"""
+Every jar the arm goes to on a visiting order, starting and ending at
+home, as (jar, True if the jar is fed or False if only passed).
+"""
+def expand(order):
+    path, jar = [], None
+    for next_jar in order:
+        path += [(via, False) for via in vias(jar, next_jar)] + [(next_jar, True)]
+        jar = next_jar
+    return path + [(via, False) for via in exit_vias(jar)]
+
+"""
+Table of move times between every pair of nodes of a path. The path
+ends at a last node standing for home, which is left for from any jar.
+"""
+def cost_table(nodes):
+    cost = [[leg_time(a, b) for b in nodes] + [exit_time(a)] for a in nodes]
+    return cost + [[np.inf]*(len(nodes) + 1)]
+
+"""
+Column serpentine the cart has always used.
+"""
+def serpentine():
+    order = []
+    for x in range(jar_cols):
+        rows = range(jar_rows) if x % 2 == 0 else range(jar_rows-1, -1, -1)
+        order += [(x, y) for y in rows]
+    return order
+
+"""
+Total move time for a visiting order, starting and ending at home.
+"""
+def route_time(order):
+    path = [None] + list(order)
+    return sum(leg_time(a, b) for a, b in zip(path, path[1:])) + exit_time(path[-1])
+
+"""
+Visit the jars nearest first from start, by move time.
+"""
+def nearest_neighbor(cost, start, nodes):
+    path, left = [start], set(nodes)
+    while left:
+        nearest = min(left, key=lambda n: cost[path[-1]][n])
+        path.append(nearest)
+        left.remove(nearest)
+    return path
+
+"""
+Improve a path with fixed ends by reversing segments (2-opt).
+"""
+def two_opt(cost, path):
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(path)-2):
+            for j in range(i+1, len(path)-1):
+                a, b, c, d = path[i-1], path[i], path[j], path[j+1]
+                if cost[a][c] + cost[b][d] < cost[a][b] + cost[c][d] - 1e-9:
+                    path[i:j+1] = path[i:j+1][::-1]
+                    improved = True
+    return path
+
+"""
+Improve a path with fixed ends by moving runs of up to three jars to
+another place in the path, in either direction (Or-opt).
+"""
+def or_opt(cost, path):
+    improved = True
+    while improved:
+        improved = False
+        for length in (1, 2, 3):
+            for i in range(1, len(path)-length):
+                segment = path[i:i+length]
+                before, after = path[i-1], path[i+length]
+                removed = cost[before][segment[0]] + cost[segment[-1]][after] \
+                          - cost[before][after]
+                rest = path[:i] + path[i+length:]
+                best, best_gain = None, 1e-9
+                for j in range(len(rest)-1):
+                    a, b = rest[j], rest[j+1]
+                    for s in (segment, segment[::-1]):
+                        gain = removed - (cost[a][s[0]] + cost[s[-1]][b] - cost[a][b])
+                        if gain > best_gain:
+                            best, best_gain = (j, s), gain
+                if best:
+                    j, s = best
+                    path[:] = rest[:j+1] + s + rest[j+1:]
+                    improved = True
+                    break
+            if improved:
+                break
+    return path
+
+"""
+Plan the order to visit all jars, or the jars given.
+The path runs from home through every jar and back home, built nearest
+first and then improved with 2-opt and Or-opt until neither finds a
+shorter path. Moves are timed the way that keeps clear of the walls.
+Returns the jar order.
+"""
+def plan(jars=None):
+    if jars is None:
+        jars = serpentine()
+    nodes = [None] + list(jars)
+    cost = cost_table(nodes)
+    last = len(nodes)
+
+    path = nearest_neighbor(cost, 0, range(1, last)) + [last]
+    while True:
+        length = sum(cost[a][b] for a, b in zip(path, path[1:]))
+        or_opt(cost, two_opt(cost, path))
+        if sum(cost[a][b] for a, b in zip(path, path[1:])) >= length - 1e-9:
+            break
+
+    return [nodes[n] for n in path[1:-1]]
+
+"""
+Print the predicted move time of the planned order against the
+column serpentine.
+"""
+def report():
+    old = route_time(serpentine())
+    new = route_time(plan())
+    print("Serpentine move time: %.1f s" % old)
+    print("Planned move time:    %.1f s" % new)
+    print("Predicted saving:     %.1f s (%.1f%%)" % (old - new, 100*(old - new)/old))
+
+
+if __name__ == '__main__':
+    report()
@@ -0,0 +1,48 @@
+import asyncio
+
+# Actuators that actions can hold. An action only runs once every
+# resource it declares is free, and holds them all until it finishes.
+resources = {'steppers', 'servo', 'dc'}
+
+# Resources currently held by a running action
+busy = set()
+
+# Condition used to wait for resources, and the event loop it belongs to
+condition, condition_loop = None, None
+
+def get_condition():
+    global condition, condition_loop
+    loop = asyncio.get_running_loop()
+    if condition_loop is not loop:
+        condition, condition_loop = asyncio.Condition(), loop
+    return condition
+
+"""
+Run an action coroutine once all of its resources are free.
+The resources are claimed together, so two actions sharing any
+resource never overlap and no action can hold some resources while
+waiting on others. They are freed if the action fails or is cancelled.
+"""
+async def run(needs, action, *args):
+    needs = set(needs)
+    unknown = needs - resources
+    if unknown:
+        raise ValueError("Unknown resources: " + str(unknown))
+
+    condition = get_condition()
+    async with condition:
+        await condition.wait_for(lambda: not (busy & needs))
+        busy.update(needs)
+    try:
+        return await action(*args)
+    finally:
+        async with condition:
+            busy.difference_update(needs)
+            condition.notify_all()
+
+"""
+Run an action as a separate task.
+Returns the task, which can be awaited for the result or cancelled.
+"""
+def submit(needs, action, *args):
+    return asyncio.create_task(run(needs, action, *args))
@@ -0,0 +1,51 @@
+import math
+from config import *
+
+# Model of the measure plate servo. The time a move takes is worked out
+# from how far the plate turns at servo_slew, so each move waits just
+# as long as it needs. With servo_ramp set, the pulse width is stepped
+# towards the target once every PWM frame at servo_slew instead of
+# jumping there.
+
+# Length of one 50Hz PWM frame (seconds)
+frame = 1/50
+
+# Angle range of the servo, turned through when the start is unknown
+servo_range = 180
+
+# Angle the servo was last sent to, or None if it is unknown, e.g.
+# before the first move or after the servo was released
+angle = None
+
+def pulse_width(angle):
+    return angle * 2000/180 + 500
+
+"""
+Time in seconds to turn between two angles, from anywhere if the start
+angle is unknown.
+"""
+def travel_time(start, end):
+    distance = servo_range if start is None else abs(end - start)
+    return distance / servo_slew
+
+"""
+Move to an angle. Returns (pulse width, seconds to hold it) of each
+step of the move; the last step holds until the servo has settled.
+"""
+def move(target):
+    global angle
+    start, angle = angle, target
+    travel = travel_time(start, target)
+    if not servo_ramp or start is None or travel == 0:
+        return [(pulse_width(target), travel + servo_settle)]
+
+    frames = math.ceil(travel / frame)
+    steps = [(pulse_width(start + (target - start)*i/frames), frame) for i in range(1, frames)]
+    return steps + [(pulse_width(target), frame + servo_ramp_settle)]
+
+"""
+Note that the servo was released, so its angle is no longer known.
+"""
+def release():
+    global angle
+    angle = None
@@ -0,0 +1,354 @@
+import asyncio
+import selectors
+from collections import deque
+from config import *
+
+# Simulated stand-in for the pigpio module, used when CVT60_SIM is set.
+# All connections share one simulated board and a virtual clock, which
+# sleep() and the simulated event loop advance instantly.
+
+OUTPUT = 1
+INPUT = 0
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+WAVE_MODE_ONE_SHOT = 0
+WAVE_MODE_REPEAT = 1
+WAVE_MODE_ONE_SHOT_SYNC = 2
+WAVE_MODE_REPEAT_SYNC = 3
+WAVE_NOT_FOUND = 9998
+NO_TX_WAVE = 9999
+
+# Stepper wiring, matching the pin assignments in cart.py
+# step pin: (axis, direction pin, direction level that moves toward home)
+steppers = {
+    21:(1, 13, 0),
+    12:(2, 20, 1),
+    }
+ena_pin = 24                # Steps are ignored while this is low
+limit_pins = {1:23, 2:22}   # Limit switch pin of each axis
+stop_pin = 2
+
+# Arm angle in degrees from home at which each limit switch closes.
+# Homing drives past the switch by the calibration adjustment.
+limit_angle = {
+    1:stepper_cal_1*step_mode / stepper_1_deg_to_step,
+    2:stepper_cal_2*step_mode / stepper_2_deg_to_step,
+    }
+
+# Step rate in steps per second above which a simulated axis stalls and
+# loses steps, like a real motor driven too fast
+stall_speed = {
+    1:2400 * step_mode/8,
+    2:1800 * step_mode/8,
+    }
+
+# Time from sending a wave to its first edge in seconds
+wave_latency = 20 / 1000000
+
+# Arm angles in degrees from home at the start of a simulation
+start_angle = {1:0, 2:0}
+
+deg_to_step = {1:stepper_1_deg_to_step, 2:stepper_2_deg_to_step}
+
+"""
+State of the simulated board.
+"""
+def reset():
+    global now, levels, servo, position, waves, pending, edges, tx_wave, tx_end, \
+           queued, callbacks, watched, button_events, glitch_filter, limit_steps, last_step, \
+           lost_steps
+    now = 0.0
+    levels = {pin: 0 for pin in range(54)}
+    levels[stop_pin] = 1
+    servo = {}
+    position = {axis: round(start_angle[axis]*deg_to_step[axis]) for axis in (1, 2)}
+    waves = {}
+    pending = []
+    edges = deque()         # (time, on mask, off mask) of the wave being sent
+    tx_wave = NO_TX_WAVE
+    tx_end = 0.0
+    queued = None           # Wave waiting for the current one to end
+    callbacks = []
+    watched = set()         # Pins with callbacks
+    button_events = deque() # (time, level, True once filtered) of the stop button
+    glitch_filter = {}      # Steady time in seconds of pins with a glitch filter
+    limit_steps = {axis: round(limit_angle[axis]*deg_to_step[axis]) for axis in (1, 2)}
+    last_step = {1:None, 2:None}
+    lost_steps = {1:0, 2:0}
+    for axis in (1, 2):
+        levels[limit_pins[axis]] = limit_level(axis)
+
+def limit_level(axis):
+    return int(position[axis] <= limit_steps[axis])
+
+"""
+Arm angles in degrees from home.
+"""
+def angles():
+    return {axis: position[axis] / deg_to_step[axis] for axis in (1, 2)}
+
+def tick():
+    return int(now * 1000000) & 0xffffffff
+
+"""
+Press the stop button at a time in seconds and hold it for held seconds.
+"""
+def press_stop(at, held=1):
+    button_events.extend([(at, 0, False), (at + held, 1, False)])
+
+"""
+Set the level of a pin, calling any callbacks watching for the edge.
+A rising edge on a step pin moves its axis while the motors are
+enabled, which may open or close a limit switch. Steps coming faster
+than the stall speed of the axis are lost.
+Returns True if any callback was called, other than edge tallies.
+"""
+def set_level(pin, level):
+    if levels[pin] == level:
+        return False
+    levels[pin] = level
+
+    called = False
+    if pin in watched:
+        for gpio, edge, func, wakes in list(callbacks):
+            if gpio == pin and edge in (EITHER_EDGE, RISING_EDGE if level else FALLING_EDGE):
+                func(gpio, level, tick())
+                called |= wakes
+
+    if level and pin in steppers and levels[ena_pin]:
+        axis, dir_pin, toward_home = steppers[pin]
+        previous, last_step[axis] = last_step[axis], now
+        if previous is not None and now - previous < 1/stall_speed[axis]:
+            lost_steps[axis] += 1
+            return called
+        position[axis] += -1 if levels[dir_pin] == toward_home else 1
+        called |= set_level(limit_pins[axis], limit_level(axis))
+    return called
+
+def apply(on, off):
+    called = False
+    for pin in steppers:
+        if off & (1 << pin):
+            called |= set_level(pin, 0)
+        if on & (1 << pin):
+            called |= set_level(pin, 1)
+    return called
+
+def start_wave(wave_id, at):
+    global tx_wave, tx_end
+    t = at
+    for on, off, delay in waves[wave_id]:
+        edges.append((t, on, off))
+        t += delay / 1000000
+    tx_wave, tx_end = wave_id, t
+
+"""
+Time of the next simulated event, or None if nothing is pending.
+"""
+def next_event():
+    times = []
+    if edges:
+        times.append(edges[0][0])
+    elif tx_wave != NO_TX_WAVE:
+        times.append(tx_end)
+    if button_events:
+        times.append(button_events[0][0])
+    return min(times) if times else None
+
+"""
+Advance the virtual clock to target seconds, processing pulses and
+button events on the way. Stops early at the first input edge so a
+waiting event loop can react to it. A button change is held back by the
+glitch filter of the stop pin, and dropped if the button changes again
+before then. Like pigpio, a filtered change is reported with the tick
+it passed the filter at. Returns the time reached.
+"""
+def advance(target):
+    global now, tx_wave, queued
+    while True:
+        t = next_event()
+        if t is None or t > target:
+            break
+        now = max(now, t)
+        if edges and edges[0][0] <= t:
+            time, on, off = edges.popleft()
+            if apply(on, off):
+                return now
+        elif button_events and button_events[0][0] <= t:
+            time, level, filtered = button_events.popleft()
+            steady = glitch_filter.get(stop_pin, 0)
+            if not filtered and steady:
+                if not button_events or button_events[0][0] >= time + steady:
+                    button_events.appendleft((time + steady, level, True))
+            elif set_level(stop_pin, level):
+                return now
+        else:
+            # Current wave has ended, start any wave queued behind it
+            tx_wave = NO_TX_WAVE
+            if queued is not None:
+                wave_id, queued = queued, None
+                start_wave(wave_id, t)
+    now = max(now, target)
+    return now
+
+def sleep(seconds):
+    target = now + seconds
+    while advance(target) < target:
+        pass
+
+def monotonic():
+    return now
+
+"""
+Selector for the simulated event loop. Instead of waiting for timers
+it advances the virtual clock to the next timer or simulated event.
+"""
+class VirtualSelector(selectors.SelectSelector):
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            if next_event() is None:
+                # Only another thread can wake the loop now
+                return super().select(None)
+            advance(next_event())
+        else:
+            advance(now + timeout)
+        return super().select(0)
+
+class EventLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(VirtualSelector())
+
+    def time(self):
+        return now
+
+class pulse:
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+class _callback:
+    def __init__(self, gpio, edge, func):
+        self.count = 0
+        # Without a function the callback just tallies edges
+        self.entry = (gpio, edge, func or self._tally, func is not None)
+
+    def _tally(self, gpio, level, tick):
+        self.count += 1
+
+    def tally(self):
+        return self.count
+
+    def reset_tally(self):
+        self.count = 0
+
+    def cancel(self):
+        if self.entry in callbacks:
+            callbacks.remove(self.entry)
+            if not any(entry[0] == self.entry[0] for entry in callbacks):
+                watched.discard(self.entry[0])
+
+"""
+Simulated connection to the pigpio daemon.
+"""
+class pi:
+    connected = True
+
+    def stop(self):
+        pass
+
+    def set_mode(self, gpio, mode):
+        pass
+
+    def set_pull_up_down(self, gpio, pud):
+        pass
+
+    def set_glitch_filter(self, user_gpio, steady):
+        glitch_filter[user_gpio] = steady / 1000000
+
+    def read(self, gpio):
+        return levels[gpio]
+
+    def write(self, gpio, level):
+        set_level(gpio, 1 if level else 0)
+
+    def set_PWM_frequency(self, gpio, frequency):
+        return frequency
+
+    def set_servo_pulsewidth(self, gpio, pulsewidth):
+        servo[gpio] = pulsewidth
+
+    def get_servo_pulsewidth(self, gpio):
+        return servo.get(gpio, 0)
+
+    def get_current_tick(self):
+        return tick()
+
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+        cb = _callback(user_gpio, edge, func)
+        callbacks.append(cb.entry)
+        watched.add(user_gpio)
+        return cb
+
+    def wave_clear(self):
+        waves.clear()
+        pending.clear()
+
+    def wave_add_generic(self, pulses):
+        pending.extend((p.gpio_on, p.gpio_off, p.delay) for p in pulses)
+        return len(pending)
+
+    def wave_create(self):
+        wave_id = 0
+        while wave_id in waves:
+            wave_id += 1
+        waves[wave_id] = list(pending)
+        pending.clear()
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        waves.pop(wave_id, None)
+
+    def wave_send_using_mode(self, wave_id, mode):
+        global queued
+        if mode in (WAVE_MODE_ONE_SHOT_SYNC, WAVE_MODE_REPEAT_SYNC) and self.wave_tx_busy():
+            queued = wave_id
+        else:
+            self.wave_tx_stop()
+            start_wave(wave_id, now + wave_latency)
+        return len(waves[wave_id])
+
+    def wave_send_once(self, wave_id):
+        return self.wave_send_using_mode(wave_id, WAVE_MODE_ONE_SHOT)
+
+    def wave_chain(self, data):
+        global tx_wave, tx_end
+        self.wave_tx_stop()
+        t = now + wave_latency
+        for wave_id in fakepigpio.expand_chain(data):
+            start_wave(wave_id, t)
+            t = tx_end
+        tx_wave = WAVE_NOT_FOUND
+
+    def wave_tx_busy(self):
+        return int(tx_wave != NO_TX_WAVE)
+
+    def wave_tx_at(self):
+        return tx_wave
+
+    def wave_tx_stop(self):
+        global tx_wave, queued
+        edges.clear()
+        tx_wave, queued = NO_TX_WAVE, None
+
+# Imported last, as fakepigpio imports hardware, which imports this module
+import fakepigpio
+
+reset()
@@ -0,0 +1,45 @@
+# Simulated stand-in for an authorized gspread client, used by logger.py
+# when CVT60_SIM is set. Sheets are kept in memory. Setting failures
+# makes that many of the following calls raise, to exercise retrying.
+
+sheets = {}
+failures = 0
+
+def reset():
+    global failures
+    sheets.clear()
+    failures = 0
+
+def check():
+    global failures
+    if failures:
+        failures -= 1
+        raise ConnectionError("Simulated Google Sheets failure")
+
+class Worksheet:
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+
+    def col_values(self, col):
+        check()
+        self.calls += 1
+        return [row[col-1] if len(row) >= col else '' for row in self.rows]
+
+    def append_rows(self, values, value_input_option='RAW'):
+        check()
+        self.calls += 1
+        self.rows += [list(row) for row in values]
+
+class Spreadsheet:
+    def __init__(self, name):
+        self.sheet1 = sheets.setdefault(name, Worksheet())
+
+class Client:
+    def open(self, name):
+        check()
+        return Spreadsheet(name)
+
+def authorize():
+    check()
+    return Client()
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+
+import os
+import sys
+from time import perf_counter
+
+# Run everything against the simulated board
+os.environ['CVT60_SIM'] = '1'
+
+import cart
+import hardware
+import simpigpio
+
+"""
+Simulate a full feeding cycle, including homing, on the virtual clock.
+Returns the result and the projected real time of the cycle in seconds.
+"""
+def simulate(day):
+    simpigpio.reset()
+    cart.setup()
+    result = hardware.run(cart.run_cycle(day))
+    return result, simpigpio.monotonic()
+
+
+if __name__ == '__main__':
+    # Feeding day (1-5) to simulate
+    day = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    start = perf_counter()
+    result, projected = simulate(day)
+    print("Result:              " + result)
+    print("Projected duration:  %.3f s" % projected)
+    print("Simulated in:        %.3f s" % (perf_counter() - start))
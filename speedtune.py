@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+import datetime
+import json
+import os
+import cart
+import config
+import hardware
+import timing
+
+# Finds the fastest speed each axis of this unit runs at without losing
+# steps. Batches of moves are run at rising multiples of the configured
+# max_vel and max_acc. After each pass of a batch both limit switches
+# are touched, and an axis whose switch closes away from where it should
+# has lost steps. Touching after every pass keeps an axis that stalls
+# within reach of homing. The highest multiple that kept each axis in place, less a
+# safety margin, is saved to config.tuning_path for every later run.
+
+# Multiples of the configured speed and acceleration tried in turn
+scales = [1.0, 1.25, 1.5, 1.75, 2.0, 2.5, 3.0]
+
+# Jars visited in each pass of a batch, repeated batch_repeats times.
+# Long moves in both directions between the corners and the middle.
+batch_jars = [(10,0), (0,6), (10,6), (0,0), (5,3), (10,0), (0,0), (10,6), (0,6), (5,3)]
+batch_repeats = 3
+
+# Steps a limit switch may close away from where it is expected before
+# the axis counts as having lost steps
+drift_tolerance = config.step_mode
+
+# Share of the fastest drift-free speed that is saved
+safety_margin = 0.8
+
+"""
+Whether every axis of a drift measured by cart.touch_limits() stayed
+in place.
+"""
+def steady(drift):
+    return all(steps is not None and abs(steps) <= drift_tolerance for steps in drift.values())
+
+"""
+Run one batch of moves at the given multiples of the untuned limits,
+touching the limit switches after every pass. The batch ends early at
+the first pass that drifts. Returns the drift of the last pass.
+"""
+async def run_batch(scale, base_vel, base_acc):
+    for axis in (1, 2):
+        config.max_vel[axis] = base_vel[axis]*scale[axis]
+        config.max_acc[axis] = base_acc[axis]*scale[axis]
+    for i in range(batch_repeats):
+        jar = None
+        for next_jar in batch_jars:
+            await cart.travel(jar, next_jar)
+            jar = next_jar
+        await cart.leave(jar)
+        drift = await cart.touch_limits()
+        if not steady(drift):
+            break
+    return drift
+
+"""
+Raise the speed of each axis until it drifts. Returns the highest
+drift-free multiple of each axis, the drift measured at every try and
+the error if the arm could not be homed after a drift, else None.
+"""
+async def tune():
+    # Start from the untuned limits, whatever this unit was tuned to before
+    base_vel = {axis: config.max_vel[axis]/config.speed_scale[axis] for axis in (1, 2)}
+    base_acc = {axis: config.max_acc[axis]/config.speed_scale[axis] for axis in (1, 2)}
+    passed = {1:None, 2:None}
+    failed = set()
+    tries = []
+    lost = None
+
+    await cart.home()
+    for scale in scales:
+        trial = {axis: passed[axis] if axis in failed else scale for axis in (1, 2)}
+        with timing.phase('batch', scale=trial):
+            drift = await run_batch(trial, base_vel, base_acc)
+        tries.append(dict(scale=trial, drift=drift))
+        print("Speed x%s: drift %s steps" % (trial, drift))
+
+        for axis in (1, 2):
+            if axis in failed:
+                continue
+            if drift.get(axis) is not None and abs(drift[axis]) <= drift_tolerance:
+                passed[axis] = scale
+            else:
+                failed.add(axis)
+        if None in drift.values():
+            # A switch was missed, so the axes were not zeroed
+            try:
+                await cart.home()
+            except cart.CycleError as e:
+                lost = str(e)
+                break
+        if len(failed) == 2 or passed[1] is None or passed[2] is None:
+            break
+
+    for axis in (1, 2):
+        config.max_vel[axis], config.max_acc[axis] = base_vel[axis], base_acc[axis]
+    if lost is None:
+        await cart.home()
+    return passed, tries, lost
+
+"""
+Save the tuned speed multiple of each axis for later runs to load.
+"""
+def save(passed, tries):
+    tuning = dict(unit=config.unit_number, date=str(datetime.datetime.now()),
+                  speed_scale={axis: round(passed[axis]*safety_margin, 3) for axis in (1, 2)},
+                  safety_margin=safety_margin, tries=tries)
+    with open(config.tuning_path + '.tmp', 'w') as file:
+        json.dump(tuning, file, indent=2)
+    os.replace(config.tuning_path + '.tmp', config.tuning_path)
+    return tuning['speed_scale']
+
+"""
+Tune and save the result. The scales that passed are saved even if the
+arm was lost on the way, which is then added to the result.
+"""
+async def run():
+    passed, tries, lost = await tune()
+    if None in passed.values():
+        result = "TUNING FAILED: AXIS DRIFTS AT CONFIGURED SPEED"
+    else:
+        result = "TUNED SPEED SCALE %s" % save(passed, tries)
+    return result if lost is None else result + ", " + lost
+
+async def shutdown(result):
+    # Release motors
+    cart.pi.write(cart.ena_pin, cart.disable)
+    cart.release_servo()
+    cart.pi.write(cart.dc_pin, 1)
+    cart.pi.stop()
+
+    timing.finish(result)
+    print(result)
+
+async def main():
+    cart.setup()
+    timing.start_run(unit=config.unit_number, mode='speedtune')
+    result = await cart.run_until_stopped(run())
+    await shutdown(result)
+
+
+if __name__ == '__main__':
+    hardware.run(main())
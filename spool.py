@@ -0,0 +1,49 @@
+import json
+import sqlite3
+import datetime
+from contextlib import closing
+
+# Local database holding results until they are logged on Google Sheets
+spool_path = '/home/pi/cvt60_spool.db'
+
+def connect():
+    db = sqlite3.connect(spool_path, timeout=10)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS results ('
+               'key TEXT PRIMARY KEY, date TEXT, time TEXT, unit TEXT, result TEXT, '
+               'data TEXT, shipped INTEGER NOT NULL DEFAULT 0)')
+    return db
+
+"""
+Add a result to the spool, with a dict of any extra data such as cycle
+timings. Its key is unique to the unit and time, so the same result is
+never logged twice. Returns the key.
+"""
+def add(unit, result, data=None, now=None):
+    date = str(now or datetime.datetime.now())
+    key = unit + '-' + date
+    with closing(connect()) as db, db:
+        db.execute('INSERT OR IGNORE INTO results (key, date, time, unit, result, data) '
+                   'VALUES (?, ?, ?, ?, ?, ?)',
+                   (key, date[:10], date[11:19], unit, result, json.dumps(data or {})))
+    return key
+
+"""
+Oldest results not yet logged, as (key, date, time, unit, result, data).
+"""
+def pending(limit=100):
+    with closing(connect()) as db:
+        rows = db.execute('SELECT key, date, time, unit, result, data FROM results '
+                          'WHERE NOT shipped ORDER BY rowid LIMIT ?', (limit,)).fetchall()
+    return [row[:5] + (json.loads(row[5] or '{}'),) for row in rows]
+
+def mark_shipped(keys):
+    with closing(connect()) as db, db:
+        db.executemany('UPDATE results SET shipped = 1 WHERE key = ?', [(key,) for key in keys])
+
+"""
+Number of results not yet logged.
+"""
+def backlog():
+    with closing(connect()) as db:
+        return db.execute('SELECT COUNT(*) FROM results WHERE NOT shipped').fetchone()[0]
@@ -0,0 +1,141 @@
+import numpy as np
+import config
+from hardware import pigpio
+
+# Optional monitor of step pulse timing. pigpio callbacks on the step
+# pins record the tick of every pulse into preallocated arrays, which
+# are compared with the commanded pulse trains once the run is over,
+# when every callback has arrived.
+
+# Most pulses recorded for each pin in a run
+capacity = 1 << 18
+
+# Steps whose acceleration is above max_acc by more than this factor
+# count as exceeding the safe acceleration
+acc_margin = 1.2
+
+# Inner bin edges in us of the histogram of step interval errors. The
+# outer bins take everything beyond them.
+jitter_edges = [-100, -20, -5, 5, 20, 100]
+
+# Recorded ticks and pulse count of each step pin, and the axis it drives
+ticks = {}
+counts = {}
+axes = {}
+
+# (start tick, end tick, {pin: commanded step times in us}) of each move
+moves = []
+
+callbacks = []
+
+"""
+Start recording pulses on step pins, given as {pin: axis}.
+"""
+def start(pi, pins):
+    stop()
+    moves.clear()
+    for pin, axis in pins.items():
+        ticks[pin] = np.zeros(capacity, dtype=np.uint32)
+        counts[pin] = 0
+        axes[pin] = axis
+        callbacks.append(pi.callback(pin, pigpio.RISING_EDGE, record))
+
+def record(gpio, level, tick):
+    i = counts[gpio]
+    if i < capacity:
+        ticks[gpio][i] = tick
+    counts[gpio] = i + 1
+
+def stop():
+    for cb in callbacks:
+        cb.cancel()
+    callbacks.clear()
+
+def active():
+    return bool(callbacks)
+
+"""
+Note a move played between two ticks, with its commanded pulse train.
+"""
+def add_move(start_tick, end_tick, pulses):
+    edge_times = np.cumsum([0] + [p[2] for p in pulses[:-1]], dtype=np.int64)
+    on = np.array([p[0] for p in pulses], dtype=np.int64)
+    commanded = {pin: edge_times[(on & (1 << pin)) != 0] for pin in ticks}
+    moves.append((start_tick, end_tick, commanded))
+
+"""
+Ticks recorded on a pin after one tick and up to another, in us from
+the first tick.
+"""
+def recorded(pin, start_tick, end_tick):
+    pin_ticks = ticks[pin][:min(counts[pin], capacity)]
+    # Unsigned subtraction handles the tick wrapping every 72 minutes
+    since = pin_ticks - np.uint32(start_tick)
+    during = (since > 0) & (since <= np.uint32((end_tick - start_tick) & 0xffffffff))
+    return since[during].astype(np.int64)
+
+"""
+Compare the pulses recorded on one pin during a move with the commanded
+step times, both in us from the start of the move. Returns the step
+counts, the latest and earliest pulse against the commanded timing, the
+histogram of interval errors, the number and share of steps above the
+safe acceleration, and the interval errors themselves.
+"""
+def check(pin, actual, commanded):
+    result = dict(commanded=len(commanded), recorded=len(actual))
+    if len(actual) != len(commanded) or len(actual) < 3:
+        return result, np.zeros(0)
+
+    late = actual - commanded
+    errors = np.diff(actual) - np.diff(commanded)
+
+    # Speed of each interval and acceleration between neighbouring intervals
+    intervals = np.diff(actual) / 1000000
+    speed = 1 / intervals
+    acc = np.abs(np.diff(speed)) / ((intervals[1:] + intervals[:-1])/2)
+    over = int(np.count_nonzero(acc > acc_margin*config.max_acc[axes[pin]]))
+
+    result.update(max_late=int(late.max()), max_early=int(-late.min()),
+                  mean_error=round(float(np.abs(errors).mean()), 2),
+                  jitter_histogram=histogram(errors), over_acc=over,
+                  over_acc_share=round(over / len(commanded), 4))
+    return result, errors
+
+"""
+Counts of interval errors in us in the bins between jitter_edges.
+"""
+def histogram(errors):
+    return np.histogram(errors, [-np.inf] + jitter_edges + [np.inf])[0].tolist()
+
+"""
+Per-move and per-run results for every axis.
+"""
+def summary():
+    per_move, errors = [], {pin: [] for pin in ticks}
+    totals = {pin: dict(axis=axes[pin], commanded=0, recorded=0, max_late=0, over_acc=0)
+              for pin in ticks}
+    for start_tick, end_tick, commanded in moves:
+        actual = {pin: recorded(pin, start_tick, end_tick) for pin in ticks}
+        # The move started with the first pulse on any pin
+        first = min((times[0] for times in actual.values() if len(times)), default=0)
+        move = {}
+        for pin in ticks:
+            if not len(commanded[pin]):
+                continue
+            result, move_errors = check(pin, actual[pin] - first, commanded[pin])
+            move[axes[pin]] = result
+            errors[pin].append(move_errors)
+            total = totals[pin]
+            total['commanded'] += result['commanded']
+            total['recorded'] += result['recorded']
+            total['max_late'] = max(total['max_late'], result.get('max_late', 0))
+            total['over_acc'] += result.get('over_acc', 0)
+        per_move.append(move)
+
+    for pin, total in totals.items():
+        all_errors = np.concatenate(errors[pin]) if errors[pin] else np.zeros(0)
+        total['over_acc_share'] = round(total['over_acc'] / max(total['commanded'], 1), 4)
+        total['jitter_histogram'] = histogram(all_errors)
+        total['dropped'] = max(counts[pin] - capacity, 0)
+    return dict(run={axes[pin]: total for pin, total in totals.items()},
+                moves=per_move, jitter_edges=jitter_edges)
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import glob
+import datetime
+import numpy as np
+from contextlib import contextmanager
+from hardware import monotonic
+
+# Directory that run traces are written to
+trace_dir = '/home/pi/traces'
+
+# Number of slowest moves listed in the report
+slowest_count = 10
+
+# Records of the current run, written out by finish()
+records = []
+run_start = None
+
+"""
+Start timing a new run. Extra fields (e.g. unit and feeding day) are
+stored in the run record.
+"""
+def start_run(**fields):
+    global run_start
+    records.clear()
+    run_start = monotonic()
+    records.append(dict(phase='run', date=str(datetime.datetime.now()), **fields))
+
+"""
+Add fields to the record of the current run.
+"""
+def annotate(**fields):
+    if run_start is not None:
+        records[0].update(fields)
+
+"""
+Time a phase of the cycle.
+Records monotonic start and end times in seconds from the start of the
+run, plus any extra fields. The record is yielded so fields only known
+inside the phase can be added to it. Nothing is recorded outside a run.
+"""
+@contextmanager
+def phase(name, **fields):
+    record = dict(phase=name, **fields)
+    start = monotonic()
+    try:
+        yield record
+    finally:
+        if run_start is not None:
+            record['start'] = round(start - run_start, 6)
+            record['end'] = round(monotonic() - run_start, 6)
+            records.append(record)
+
+"""
+End the run and write its trace as one JSON record per line.
+Returns the path of the trace, or None if there was no run.
+"""
+def finish(result):
+    global run_start
+    if run_start is None:
+        return None
+    records[0]['result'] = result
+    records[0]['duration'] = round(monotonic() - run_start, 6)
+    run_start = None
+
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, datetime.datetime.now().strftime('run-%Y%m%d-%H%M%S.jsonl'))
+    with open(path, 'w') as file:
+        for record in records:
+            file.write(json.dumps(record, separators=(',', ':')) + '\n')
+    return path
+
+"""
+Duration of the last run and the total time of each of its phases.
+"""
+def summary():
+    phases = {}
+    for record in records[1:]:
+        phases[record['phase']] = round(phases.get(record['phase'], 0)
+                                        + record['end'] - record['start'], 6)
+    return dict(duration=records[0].get('duration') if records else None, phases=phases)
+
+def load_trace(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+"""
+Print per-phase totals, percentiles and the slowest moves of traces.
+"""
+def report(paths):
+    runs, phases = [], {}
+    for path in paths:
+        for record in load_trace(path):
+            if record['phase'] == 'run':
+                runs.append(record)
+            else:
+                phases.setdefault(record['phase'], []).append(record)
+
+    for run in runs:
+        print("%s  day %s  %.1f s  %s" % (run['date'][:19], run.get('day'),
+                                          run.get('duration', 0), run.get('result')))
+        if run.get('stop_latency_ms') is not None:
+            print("  stop latency %.3f ms" % run['stop_latency_ms'])
+        if 'jars_fed' in run:
+            print("  jars fed %d  saving from skipped jars %.1f s"
+                  % (run['jars_fed'], run['skip_saving']))
+        for axis, steps in sorted(run.get('step_timing', {}).get('run', {}).items()):
+            print("  axis %s  steps %d/%d  max late %d us  over max_acc %.2f%%  jitter %s"
+                  % (axis, steps['recorded'], steps['commanded'], steps['max_late'],
+                     100*steps['over_acc_share'], steps['jitter_histogram']))
+    print()
+
+    print("%-10s %6s %9s %8s %8s %8s %8s" % ('phase', 'count', 'total s',
+                                             'p50 s', 'p90 s', 'p99 s', 'max s'))
+    for name, items in sorted(phases.items()):
+        durations = np.array([r['end'] - r['start'] for r in items])
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        print("%-10s %6d %9.2f %8.3f %8.3f %8.3f %8.3f" % (name, len(durations),
+              durations.sum(), p50, p90, p99, durations.max()))
+
+    moves = sorted(phases.get('move', []), key=lambda r: r['start'] - r['end'])
+    if moves:
+        print()
+        print("Slowest moves:")
+        for r in moves[:slowest_count]:
+            print("  jar %-8s steps %-14s %.3f s" % (tuple(r.get('jar', ())),
+                  tuple(r.get('steps', ())), r['end'] - r['start']))
+
+
+if __name__ == '__main__':
+    # Report on the traces given, or the latest trace
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(trace_dir, 'run-*.jsonl')))[-1:]
+    if not paths:
+        print("No traces found in " + trace_dir)
+        sys.exit()
+    report(paths)
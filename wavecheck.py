@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import numpy as np
+
+# Run everything against the simulated board
+os.environ['CVT60_SIM'] = '1'
+
+import cycleplan
+import fakepigpio
+import hardware
+import waveform
+from hardware import pigpio
+
+# Checks of the pulse trains waveform plays, against a recording fake of
+# pigpio: that every step comes out at its time on its own pin, that
+# repeated blocks are sent as chain loops, and that moves too big for a
+# chain are streamed whole. Prints each check and exits non-zero if any
+# fails.
+
+# Step pins used by the checks
+pins = (20, 21)
+
+"""
+Random step times from 0 to about end us, at least two pulse widths
+apart as motion makes them.
+"""
+def random_steps(rng, count, end):
+    gaps = rng.integers(2*waveform.pulse_width, 2*end // count, count - 1)
+    return [0] + np.cumsum(gaps).tolist()
+
+"""
+Play a pulse train on a fresh fake and return it.
+"""
+def played(pulses):
+    pi = fakepigpio.pi()
+    hardware.run(waveform.play(pi, pulses))
+    return pi
+
+"""
+Whether each pin's edges come out at the step times and a pulse width
+later.
+"""
+def edges_match(pi, steps):
+    edges = pi.edges(list(steps))
+    return all(edges[pin][0] == sorted(times) and
+               edges[pin][1] == [t + waveform.pulse_width for t in sorted(times)]
+               for pin, times in steps.items())
+
+def check_edges():
+    rng = np.random.default_rng(1)
+    steps = {pin: random_steps(rng, 300, 200000) for pin in pins}
+    # Steps of both axes at once share pulses
+    steps[pins[1]] = steps[pins[0]][:20] + [t for t in steps[pins[1]] if t > steps[pins[0]][20]]
+    pulses = waveform.pulse_train(steps, 500000)
+    pi = played(pulses)
+    return (edges_match(pi, steps) and pi.played == pulses and
+            sum(p[2] for p in pi.played) == 500000)
+
+def check_chain_loops():
+    steps = {pins[0]: list(range(0, 2000000, 100))}
+    pulses = waveform.pulse_train(steps, 2000000)
+    pi = played(pulses)
+    kind, data = pi.sends[0]
+    return (len(pi.sends) == 1 and kind == 'chain' and data.count(255) >= 2 and
+            len(data) <= fakepigpio.max_chain_bytes and pi.played == pulses and
+            edges_match(pi, steps) and not pi.waves)
+
+def check_streaming():
+    chain_pulses = waveform.max_chain_pulses
+    waveform.max_chain_pulses = 100
+    try:
+        rng = np.random.default_rng(2)
+        steps = {pin: random_steps(rng, 6000, 5000000) for pin in pins}
+        pulses = waveform.pulse_train(steps, 15000000)
+        pi = played(pulses)
+    finally:
+        waveform.max_chain_pulses = chain_pulses
+    return (all(send == ('wave', pigpio.WAVE_MODE_ONE_SHOT_SYNC) for send in pi.sends) and
+            len(pi.sends) > 1 and pi.played == pulses and edges_match(pi, steps) and
+            not pi.waves)
+
+def check_move():
+    pulses, duration = cycleplan.move_pulses(3000, -1200, pins)
+    pi = played(pulses)
+    edges = pi.edges(pins)
+    return (pi.played == pulses and sum(p[2] for p in pi.played) == duration and
+            [len(edges[pin][0]) for pin in pins] == [3000, 1200] and
+            all(len(edges[pin][0]) == len(edges[pin][1]) for pin in pins))
+
+checks = [
+    ("edge times of each pin", check_edges),
+    ("chain loops of a cruise", check_chain_loops),
+    ("streaming of a long move", check_streaming),
+    ("coordinated move", check_move),
+    ]
+
+
+if __name__ == '__main__':
+    failed = 0
+    for name, check in checks:
+        ok = check()
+        failed += not ok
+        print("%-30s %s" % (name, "ok" if ok else "FAILED"))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,170 @@
+import asyncio
+import numpy as np
+from hardware import pigpio
+
+# Width of each step pulse in microseconds (drivers need at least ~3us)
+pulse_width = 10
+
+# Number of pulses per wave block. Moves are split into blocks so that
+# repeated blocks (e.g. the cruise section of a move) share one wave.
+block_pulses = 500
+
+# Maximum number of unique pulses held in wave memory for a chained move.
+# Moves needing more than this are streamed block by block instead.
+max_chain_pulses = 8000
+
+# Maximum length of a wave chain in bytes (pigpio limit)
+max_chain_bytes = 600
+
+# Time between checks for the end of a wave in seconds
+poll_wait = 2 / 1000
+
+
+"""
+Convert step times into a single pulse train.
+Takes a dict of {step pin: step times in us} and the total duration
+of the move in us. Each step raises its pin for pulse_width us. Edges
+from all pins are merged onto one timeline, so the axes can be played
+together as one waveform. Returns a list of (on mask, off mask, delay)
+tuples as used by pigpio.pulse.
+"""
+def pulse_train(steps, duration):
+    times, on, off = [], [], []
+    for pin, step_times in steps.items():
+        step_times = np.asarray(step_times, dtype=np.int64)
+        mask = np.full(len(step_times), 1 << pin, dtype=np.int64)
+        times += [step_times, step_times + pulse_width]
+        on += [mask, np.zeros_like(mask)]
+        off += [np.zeros_like(mask), mask]
+
+    times = np.concatenate(times)
+    if not len(times):
+        return []
+
+    # Combine edges that fall on the same microsecond
+    edge_times, index = np.unique(times, return_inverse=True)
+    on_mask = np.zeros(len(edge_times), dtype=np.int64)
+    off_mask = np.zeros(len(edge_times), dtype=np.int64)
+    np.bitwise_or.at(on_mask, index, np.concatenate(on))
+    np.bitwise_or.at(off_mask, index, np.concatenate(off))
+
+    # Delay of each pulse is the time until the next edge
+    end = max(duration, edge_times[-1])
+    delays = np.diff(edge_times, append=end)
+
+    return list(zip(on_mask.tolist(), off_mask.tolist(), delays.tolist()))
+
+"""
+Split a pulse train into blocks and run-length encode repeated blocks.
+Returns a list of [block, repeat count].
+"""
+def blocks(pulses, size=block_pulses):
+    runs = []
+    for i in range(0, len(pulses), size):
+        block = tuple(pulses[i:i+size])
+        if runs and runs[-1][0] == block:
+            runs[-1][1] += 1
+        else:
+            runs.append([block, 1])
+    return runs
+
+"""
+Build the wave chain for a list of [wave id, repeat count] runs.
+Repeated runs use the pigpio chain loop command.
+"""
+def chain(runs):
+    data = []
+    for wave_id, count in runs:
+        while count > 1:
+            loops = min(count, 65535)
+            data += [255, 0, wave_id, 255, 1, loops & 255, loops >> 8]
+            count -= loops
+        if count == 1:
+            data.append(wave_id)
+    return data
+
+def create_wave(pi, block):
+    pi.wave_add_generic([pigpio.pulse(on, off, delay) for on, off, delay in block])
+    return pi.wave_create()
+
+"""
+Wait for the waveform being sent to end. Sleeps through the expected
+duration (in us) first so pigpio is only polled near the end.
+"""
+async def wait_for_wave(pi, duration=0):
+    await asyncio.sleep(duration / 1000000)
+    while pi.wave_tx_busy():
+        await asyncio.sleep(poll_wait)
+
+"""
+Play a pulse train and wait until it has finished.
+The whole train is sent as a single wave chain when it fits in wave
+memory. Otherwise blocks are streamed, with each block queued to start
+as soon as the previous one ends so the motors never pause mid-move.
+If the wait is cancelled the waveform is stopped at once. Nothing more
+is sent once the optional stop event is set; whoever sets it stops the
+waveform playing.
+"""
+async def play(pi, pulses, stop=None):
+    if not pulses or stopped(stop):
+        return
+
+    runs = blocks(pulses)
+    unique = {block for block, count in runs}
+    if sum(len(b) for b in unique) <= max_chain_pulses:
+        wave_ids = {block: create_wave(pi, block) for block in unique}
+        try:
+            data = chain([(wave_ids[block], count) for block, count in runs])
+            if len(data) <= max_chain_bytes:
+                if stopped(stop):
+                    return
+                pi.wave_chain(data)
+                await finish(pi, sum(p[2] for p in pulses))
+                return
+        finally:
+            for wave_id in wave_ids.values():
+                pi.wave_delete(wave_id)
+
+    await stream(pi, pulses, stop)
+
+def stopped(stop):
+    return stop is not None and stop.is_set()
+
+"""
+Wait for the waveform being sent to end, stopping it if the wait is
+cancelled or fails.
+"""
+async def finish(pi, duration):
+    try:
+        await wait_for_wave(pi, duration)
+    except BaseException:
+        pi.wave_tx_stop()
+        raise
+
+"""
+Stream a pulse train one block at a time.
+The next block is created while the current one plays and is queued
+with WAVE_MODE_ONE_SHOT_SYNC so there is no gap between blocks.
+Streaming ends early once the stop event is set.
+"""
+async def stream(pi, pulses, stop=None, size=4*block_pulses):
+    wave_ids = []
+    try:
+        for i in range(0, len(pulses), size):
+            if stopped(stop):
+                break
+            wave_id = create_wave(pi, pulses[i:i+size])
+            wave_ids.append(wave_id)
+            pi.wave_send_using_mode(wave_id, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            if len(wave_ids) > 1:
+                # Wait until the queued block starts before freeing the last one
+                while pi.wave_tx_at() not in (wave_id, pigpio.NO_TX_WAVE):
+                    await asyncio.sleep(poll_wait)
+                pi.wave_delete(wave_ids.pop(0))
+        await wait_for_wave(pi)
+    except BaseException:
+        pi.wave_tx_stop()
+        raise
+    finally:
+        for wave_id in wave_ids:
+            pi.wave_delete(wave_id)
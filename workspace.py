@@ -0,0 +1,115 @@
+import os
+import hashlib
+import numpy as np
+from functools import lru_cache
+import kinematics
+from config import *
+
+# Model of the space the arm moves in, used to keep moves clear of the
+# cart walls. Moves are straight lines in joint space, as both axes
+# step in proportion, and are checked by sampling the elbow and the
+# dispenser along them. The walls bound a convex region that holds the
+# shoulder, so an arm whose joints are inside it is inside it too.
+#
+# Nodes are home and every jar. Home is node 0 and jar (x, y) is node
+# 1 + x*jar_rows + y.
+
+# Largest change in either joint angle between samples (degrees)
+sample_angle = 0.5
+
+"""
+Coordinates in mm of the elbow and dispenser for stepper angles in
+degrees. Accepts single angles or arrays.
+"""
+def arm_points(angle_1, angle_2):
+    upper = np.radians(180 - np.asarray(angle_1, dtype=float))
+    elbow_x, elbow_y = arm_1*np.cos(upper), arm_1*np.sin(upper)
+    tip_x, tip_y = kinematics.forward(angle_1, angle_2)
+    return elbow_x, elbow_y, tip_x, tip_y
+
+"""
+True where the arm at stepper angles in degrees is clear of the walls.
+"""
+def clear(angle_1, angle_2):
+    elbow_x, elbow_y, tip_x, tip_y = arm_points(angle_1, angle_2)
+    return ((np.abs(elbow_x) <= wall_x - elbow_radius) & (elbow_y >= wall_y + elbow_radius)
+            & (np.abs(tip_x) <= wall_x - dispenser_radius) & (tip_y >= wall_y + dispenser_radius))
+
+"""
+Angles sampled along a straight joint-space move between two pairs of
+angles.
+"""
+def sweep(a, b):
+    count = int(np.ceil(max(abs(b[0] - a[0]), abs(b[1] - a[1])) / sample_angle)) + 1
+    s = np.linspace(0, 1, count)
+    return a[0] + (b[0] - a[0])*s, a[1] + (b[1] - a[1])*s
+
+"""
+True if a straight joint-space move between two pairs of angles keeps
+clear of the walls.
+"""
+def move_clear(a, b):
+    return bool(clear(*sweep(a, b)).all())
+
+"""
+True if the arm can head home from a pair of angles clear of the
+walls. Homing turns the second axis to its switch and then the first,
+and touching the switches moves straight to next to them.
+"""
+def homing_clear(a):
+    return (move_clear(a, (a[0], 0)) and move_clear((a[0], 0), (0, 0))
+            and move_clear(a, (0, 0)))
+
+"""
+Stepper angles in degrees of every node.
+"""
+def node_angles():
+    jars = kinematics.jar_table()['angles'].reshape(-1, 2)
+    return np.concatenate([[(0, 0)], jars])
+
+def node(jar):
+    return 0 if jar is None else 1 + jar[0]*jar_rows + jar[1]
+
+def node_jar(n):
+    return None if n == 0 else divmod(n - 1, jar_rows)
+
+"""
+Hash of everything the safety table depends on.
+"""
+def workspace_key():
+    inputs = (kinematics.geometry_key(), wall_x, wall_y, dispenser_radius, elbow_radius,
+              sample_angle)
+    return hashlib.sha1(repr(inputs).encode()).hexdigest()[:16]
+
+"""
+Check the direct move between every pair of nodes, and homing from
+every node. Returns {'direct': n x n, 'homing': n} of which are clear.
+"""
+def build_safety_table():
+    angles = node_angles()
+    n = len(angles)
+    direct = np.eye(n, dtype=bool)
+    for i in range(n):
+        for j in range(i+1, n):
+            direct[i, j] = direct[j, i] = move_clear(angles[i], angles[j])
+    homing = np.array([homing_clear(a) for a in angles])
+    return {'direct': direct, 'homing': homing}
+
+"""
+Which moves between nodes are clear of the walls, stored on disk under
+a hash of the workspace so it is only rebuilt when the model changes.
+"""
+@lru_cache(maxsize=None)
+def safety_table():
+    path = os.path.join(kinematics.table_dir, 'workspace-' + workspace_key() + '.npz')
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        pass
+
+    table = build_safety_table()
+    os.makedirs(kinematics.table_dir, exist_ok=True)
+    np.savez(path + '.tmp.npz', **table)
+    os.replace(path + '.tmp.npz', path)
+    return table